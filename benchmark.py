@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from hh_parser import HeadHunter
+from hh_stub import HHStub, load_items, make_items
+
+# Отчеты, время выполнения которых измеряется: имя -> функция от DBManager
+REPORTS = {
+    'companies_and_vacancies_count': lambda db: db.get_companies_and_vacancies_count(),
+    'all_vacancies': lambda db: db.get_all_vacancies(),
+    'all_vacancies_first_page': lambda db: db.get_all_vacancies_page(50),
+    'avg_salary': lambda db: db.get_avg_salary(),
+    'vacancies_with_higher_salary': lambda db: db.get_vacancies_with_higher_salary(),
+    'vacancies_with_keyword': lambda db: db.get_vacancies_with_keyword('python'),
+    'search_vacancies': lambda db: db.search_vacancies('python разработчик'),
+}
+
+
+def percentile(values, fraction):
+    """Возвращает перцентиль по отсортированной выборке (ближайший ранг)"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def git_commit():
+    """Возвращает хеш текущего коммита, чтобы результаты можно было сравнивать между коммитами"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_fetch(stub, concurrent, max_workers):
+    """Измеряет скорость загрузки страниц HeadHunter с локального заменителя API"""
+    hh = HeadHunter('python', max_workers=max_workers, rate_limit=0, backoff=0.01, max_retries=10)
+    hh.URL = f'{stub.url}/vacancies'
+    started = time.perf_counter()
+    pages = sum(1 for _ in hh.iter_pages(concurrent=concurrent))
+    seconds = time.perf_counter() - started
+    return {'concurrent': concurrent,
+            'max_workers': max_workers,
+            'pages': pages,
+            'seconds': round(seconds, 3),
+            'pages_per_second': round(pages / seconds, 1)}
+
+
+def bench_ingest(db, size, batch_size, seed, bulk=True, chunk=10000):
+    """Пересоздает базу данных и измеряет скорость загрузки size синтетических вакансий.
+
+    При bulk=False вакансии вставляются построчно, как до перехода на COPY, для сравнения.
+    """
+    db.create_database()
+    rows = 0
+    ingest_seconds = 0.0
+    # Генерируем данные порциями, чтобы не держать в памяти миллион вакансий сразу;
+    # время генерации в замер не входит
+    for offset in range(0, size, chunk):
+        items = make_items(min(chunk, size - offset), seed=seed + offset)
+        for number, item in enumerate(items, start=offset):
+            item['id'] = str(1000000 + number)
+        started = time.perf_counter()
+        rows += db.insert_data_into_db({'items': items}, bulk=bulk, batch_size=batch_size, refresh=False)['rows']
+        ingest_seconds += time.perf_counter() - started
+    started = time.perf_counter()
+    db.refresh_aggregates()
+    refresh_seconds = time.perf_counter() - started
+    return {'size': size,
+            'mode': 'bulk' if bulk else 'row_by_row',
+            'rows': rows,
+            'seconds': round(ingest_seconds, 3),
+            'rows_per_second': round(rows / ingest_seconds),
+            'refresh_aggregates_seconds': round(refresh_seconds, 3)}
+
+
+def bench_reports(db, repeat):
+    """Измеряет p50/p95 времени выполнения каждого отчета в миллисекундах"""
+    results = {}
+    for name, report in REPORTS.items():
+        # Первый вызов прогревает кэш и подготавливает запрос на сервере, его не учитываем
+        report(db)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            report(db)
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {'p50_ms': round(percentile(timings, 0.5), 3),
+                         'p95_ms': round(percentile(timings, 0.95), 3)}
+    return results
+
+
+def drop_database(params, dbname):
+    """Удаляет временную базу данных бенчмарка"""
+    import psycopg2
+
+    conn = psycopg2.connect(dbname='postgres', **params)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {dbname}')
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк загрузки вакансий, записи в БД и отчетов '
+                                                 'без доступа к api.hh.ru')
+    parser.add_argument('--pages', type=int, default=20, help='количество страниц у заменителя API')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа заменителя API, секунды')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='доля ответов 429')
+    parser.add_argument('--seed-ndjson', help='NDJSON-файл с записанными вакансиями API для выдачи')
+    parser.add_argument('--workers', type=int, default=8, help='количество параллельных запросов')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='размеры таблицы для замеров загрузки и отчетов')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--ingest-modes', nargs='+', choices=('bulk', 'row_by_row'), default=['bulk'],
+                        help='режимы записи в БД; row_by_row медленный, его стоит запускать на малых размерах')
+    parser.add_argument('--repeat', type=int, default=20, help='количество запусков каждого отчета')
+    parser.add_argument('--skip-db', action='store_true', help='измерить только загрузку страниц')
+    parser.add_argument('--config', default='database.ini', help='файл с параметрами подключения к PostgreSQL')
+    parser.add_argument('--dbname', default='hh_benchmark', help='имя временной базы данных')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    result = {'commit': git_commit(),
+              'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'options': vars(args),
+              'fetch': [],
+              'ingest': [],
+              'reports': {}}
+
+    items = load_items(args.seed_ndjson) if args.seed_ndjson else make_items(args.pages * 100, seed=args.seed)
+    with HHStub(items, latency=args.latency, error_rate=args.error_rate, seed=args.seed) as stub:
+        for concurrent in (False, True):
+            result['fetch'].append(bench_fetch(stub, concurrent, args.workers))
+            print(result['fetch'][-1])
+        result['stub_responses'] = stub.responses
+
+    if not args.skip_db:
+        from config import config
+        from db_manager import DBManager
+
+        params = config(args.config)
+        db = DBManager(args.dbname, params)
+        try:
+            for size in args.sizes:
+                # Отчеты измеряем после последнего режима: содержимое таблиц от режима записи не зависит
+                for mode in args.ingest_modes:
+                    result['ingest'].append(bench_ingest(db, size, args.batch_size, args.seed,
+                                                         bulk=mode == 'bulk'))
+                    print(result['ingest'][-1])
+                result['reports'][str(size)] = bench_reports(db, args.repeat)
+                print(size, result['reports'][str(size)])
+        finally:
+            db.close()
+            drop_database(params, args.dbname)
+
+    with open(args.output, 'w', encoding='UTF-8') as file:
+        json.dump(result, file, indent=2, ensure_ascii=False)
+    print(f'Результаты сохранены в {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,196 @@
+import base64
+import io
 import json
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+
 import psycopg2
-from hh_parser import HeadHunter
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2 import errors
+from metrics import METRICS, load_stats
 from config import config
 
 
+class _PooledConnection(psycopg2.extensions.connection):
+    """Соединение пула, которое помнит подготовленные на нем запросы и время возврата в пул"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Имена запросов, подготовленных на этом соединении; PREPARE живет, пока открыта сессия
+        self.prepared = set()
+        # Когда соединение последний раз вернулось в пул (по time.monotonic)
+        self.released_at = time.monotonic()
+
+
+class _KeepAlivePool(ThreadedConnectionPool):
+    """Пул, который держит возвращенные соединения открытыми до maxconn, а не до minconn.
+
+    ThreadedConnectionPool закрывает возвращенное соединение, если свободных уже minconn, поэтому
+    при параллельной работе соединения открывались бы заново вместе с подготовленными на них
+    запросами. Здесь minconn задает только число соединений, открываемых при создании пула.
+    """
+
+    def _putconn(self, conn, key=None, close=False):
+        # putconn вызывает этот метод под блокировкой пула, поэтому подмена minconn безопасна
+        minconn, self.minconn = self.minconn, self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+
+
 class DBManager:
-    def __init__(self, dbname, params):
+    # Отчетные запросы, которые подготавливаются на сервере (PREPARE) один раз на соединение
+    REPORT_QUERIES = {
+        'companies_and_vacancies_count': "SELECT employer_name, quantity_vacancies "
+                                         "FROM employer_vacancy_counts "
+                                         "ORDER BY quantity_vacancies DESC, employer_name",
+        'all_vacancies': "SELECT employers.employer_name, vacancy_name, salary_max, url "
+                         "FROM vacancies "
+                         "JOIN employers USING(employer_id) "
+                         "WHERE salary_max IS NOT NULL AND NOT archived "
+                         "ORDER BY salary_max DESC, vacancy_name",
+        'avg_salary': "SELECT ROUND(avg_salary) as average_salary "
+                      "FROM salary_stats "
+                      "WHERE is_total",
+        'vacancies_with_higher_salary': "SELECT vacancy_name, salary_max "
+                                        "FROM vacancies "
+                                        "WHERE NOT archived "
+                                        "AND salary_max > (SELECT avg_salary FROM salary_stats WHERE is_total) "
+                                        "ORDER BY salary_max DESC, vacancy_name",
+        'all_vacancies_first_page': "SELECT employers.employer_name, vacancy_name, salary_max, url, vacancy_id "
+                                    "FROM vacancies "
+                                    "JOIN employers USING(employer_id) "
+                                    "WHERE salary_max IS NOT NULL AND NOT archived "
+                                    "ORDER BY salary_max DESC, vacancy_name, vacancy_id "
+                                    "LIMIT $1",
+        'all_vacancies_next_page': "SELECT employers.employer_name, vacancy_name, salary_max, url, vacancy_id "
+                                   "FROM vacancies "
+                                   "JOIN employers USING(employer_id) "
+                                   "WHERE salary_max IS NOT NULL AND NOT archived "
+                                   "AND salary_max <= $1 "
+                                   "AND (salary_max < $1 OR (vacancy_name, vacancy_id) > ($2, $3)) "
+                                   "ORDER BY salary_max DESC, vacancy_name, vacancy_id "
+                                   "LIMIT $4",
+        'salary_stats': "SELECT city, vacancies_with_salary, ROUND(avg_salary), p25, median, p75, p90 "
+                        "FROM salary_stats "
+                        "WHERE is_total <> $1 "
+                        "ORDER BY vacancies_with_salary DESC, city",
+        'vacancies_with_keyword': "SELECT vacancy_name "
+                                  "FROM vacancies "
+                                  "WHERE NOT archived AND vacancy_name ILIKE '%' || $1 || '%' "
+                                  "ORDER BY vacancy_name",
+        # Триграммы используются, только если полнотекстовый поиск ничего не нашел и в запросе нет
+        # операторов ($4): word_similarity не понимает минус и OR, а его оценки (0..1) несравнимы с ts_rank
+        'search_vacancies': "WITH fulltext AS ("
+                            "SELECT vacancy_id, vacancy_name, salary_max, url, "
+                            "GREATEST(ts_rank(search_vector, websearch_to_tsquery('russian', $1)), "
+                            "ts_rank(search_vector, websearch_to_tsquery('english', $1))) AS rank "
+                            "FROM vacancies "
+                            "WHERE NOT archived "
+                            "AND (search_vector @@ websearch_to_tsquery('russian', $1) "
+                            "OR search_vector @@ websearch_to_tsquery('english', $1))) "
+                            "SELECT * FROM fulltext "
+                            "UNION ALL "
+                            "SELECT vacancy_id, vacancy_name, salary_max, url, word_similarity($1, vacancy_name) "
+                            "FROM vacancies "
+                            "WHERE $4 AND NOT EXISTS (SELECT 1 FROM fulltext) "
+                            "AND NOT archived AND $1 <% vacancy_name "
+                            "ORDER BY rank DESC, vacancy_id "
+                            "LIMIT $2 OFFSET $3",
+    }
+
+    def __init__(self, dbname, params, minconn=1, maxconn=5, health_check=True, health_check_idle=30.0):
         # Инициализируем атрибуты класса с названием базы данных и параметрами подключения
         self.dbname = dbname
         self.params = params
+        # При создании пула открывается minconn соединений, остальные до maxconn - по требованию.
+        # Возвращенные соединения остаются открытыми (_KeepAlivePool), а последовательной загрузке
+        # хватает одного подключения
+        self.minconn = minconn
+        self.maxconn = maxconn
+        # Проверять ли запросом SELECT 1 соединение, пролежавшее в пуле дольше health_check_idle секунд
+        self.health_check = health_check
+        self.health_check_idle = health_check_idle
+        # Пул создается лениво при первом обращении к базе данных
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Работодатели, данные которых уже получены в этом процессе
+        self._enriched_employers = set()
+
+    def _get_pool(self):
+        """Возвращает пул соединений, создавая его при первом обращении"""
+        # Потоки, одновременно обратившиеся к базе данных впервые, должны получить один и тот же пул
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = _KeepAlivePool(self.minconn, self.maxconn, dbname=self.dbname,
+                                            connection_factory=_PooledConnection, **self.params)
+        return self._pool
+
+    def _is_healthy(self, conn):
+        """Проверяет, что соединение из пула живо и не находится внутри транзакции"""
+        if conn.closed or conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            return False
+        # Недавно использованное соединение считаем живым, чтобы не тратить на проверку
+        # два лишних обращения к серверу при каждом отчете
+        if not self.health_check or time.monotonic() - conn.released_at < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _discard(self, conn):
+        """Закрывает соединение и убирает его из пула"""
+        self._pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение из пула на время блока with.
+
+        При выходе из блока транзакция фиксируется, при исключении откатывается,
+        а соединение после ошибки закрывается, чтобы не вернуть в пул сломанную сессию.
+        """
+        pool = self._get_pool()
+        conn = pool.getconn()
+        # Заменяем соединение, если оно не прошло проверку
+        while not self._is_healthy(conn):
+            self._discard(conn)
+            conn = pool.getconn()
+        try:
+            with conn:
+                yield conn
+        except BaseException:
+            self._discard(conn)
+            raise
+        conn.released_at = time.monotonic()
+        pool.putconn(conn)
+
+    def close(self):
+        """Закрывает все соединения пула"""
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def create_database(self):
         """Создает базу данных и инициирует подключение к ней с указанными параметрами"""
+        # Закрываем соединения пула, иначе пересоздаваемая база данных будет занята
+        self.close()
         # Подключаемся к базе данных postgres с помощью библиотеки psycopg2
         conn = psycopg2.connect(dbname='postgres', **self.params)
         # Включаем автоматическое подтверждение транзакций
@@ -39,10 +217,28 @@ class DBManager:
             cur.close()
             conn.close()
 
-        # Подключаемся к созданной базе данных с помощью библиотеки psycopg2
-        conn = psycopg2.connect(dbname=self.dbname, **self.params)
-        # Используем менеджеры контекста для автоматического закрытия соединения и курсора
-        with conn:
+        # Создаем таблицы в новой базе данных
+        self._create_tables()
+
+    def ensure_schema(self):
+        """Создает базу данных и таблицы, только если их еще нет, не затирая существующие данные"""
+        # Подключаемся к базе данных postgres, чтобы проверить наличие нужной базы данных
+        conn = psycopg2.connect(dbname='postgres', **self.params)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1 FROM pg_database WHERE datname = %s', (self.dbname,))
+                if cur.fetchone() is None:
+                    cur.execute(f"CREATE DATABASE {self.dbname}")
+        finally:
+            conn.close()
+        # Создаем недостающие таблицы и столбцы
+        self._create_tables()
+
+    def _create_tables(self):
+        """Создает таблицы, если их нет, и добавляет столбцы, появившиеся в новых версиях схемы"""
+        # Получаем соединение с базой данных из пула
+        with self.connection() as conn:
             with conn.cursor() as cur:
                 # Создаем таблицу employers с двумя столбцами: идентификатором и названием работодателя
                 # Устанавливаем идентификатор как первичный ключ и название как уникальное значение
@@ -62,22 +258,459 @@ class DBManager:
                             'salary_min int,'
                             'salary_max int,'
                             'url text)')
-        # Закрываем соединение с базой данных (необязательно, так как менеджер контекста это делает автоматически)
-        conn.close()
-
-    def insert_data_into_db(self, data):
-        """Подключается к БД и заполняет таблицы данными из запроса"""
-        # Подключаемся к базе данных с помощью библиотеки psycopg2
-        conn = psycopg2.connect(dbname=self.dbname, **self.params)
-        # Используем менеджеры контекста для автоматического закрытия соединения и курсора
-        with conn:
+                # Добавляем столбцы для инкрементальной синхронизации: дату публикации,
+                # признак архивной вакансии и время, когда вакансия последний раз была в выдаче
+                self._add_missing_columns(cur, 'vacancies', {
+                    'published_at': 'timestamptz',
+                    'archived': 'boolean NOT NULL DEFAULT false',
+                    'last_seen_at': 'timestamptz NOT NULL DEFAULT now()'})
+                # Добавляем в таблицу employers подробные данные о работодателе из /employers/{id}
+                # и время их получения, чтобы не запрашивать свежие данные повторно
+                self._add_missing_columns(cur, 'employers', {
+                    'employer_type': 'text',
+                    'site_url': 'text',
+                    'alternate_url': 'text',
+                    'area': 'text',
+                    'industries': 'text[]',
+                    'trusted': 'boolean',
+                    'open_vacancies': 'int',
+                    'details_fetched_at': 'timestamptz'})
+                # Создаем таблицу связей ключевых слов поиска с найденными по ним вакансиями
+                cur.execute('CREATE TABLE IF NOT EXISTS vacancy_keywords '
+                            '('
+                            'search_keyword text NOT NULL, '
+                            'vacancy_id int REFERENCES vacancies(vacancy_id) ON DELETE CASCADE NOT NULL, '
+                            'PRIMARY KEY (search_keyword, vacancy_id))')
+                # Создаем таблицу с отметкой последней синхронизации по каждому ключевому слову
+                cur.execute('CREATE TABLE IF NOT EXISTS sync_state '
+                            '('
+                            'search_keyword text PRIMARY KEY, '
+                            'last_published_at timestamptz, '
+                            'last_synced_at timestamptz NOT NULL)')
+                # Добавляем поисковый вектор по названию вакансии (русская и английская морфология),
+                # PostgreSQL сам пересчитывает его при каждом изменении строки
+                self._add_missing_columns(cur, 'vacancies', {
+                    'search_vector': "tsvector GENERATED ALWAYS AS ("
+                                     "setweight(to_tsvector('russian', vacancy_name), 'A') || "
+                                     "setweight(to_tsvector('english', vacancy_name), 'B')) STORED"})
+                # GIN-индекс для полнотекстового поиска
+                cur.execute('CREATE INDEX IF NOT EXISTS vacancies_search_vector_idx '
+                            'ON vacancies USING gin (search_vector)')
+                # Триграммный GIN-индекс для поиска по подстроке (ILIKE) и нечеткого поиска
+                cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                cur.execute('CREATE INDEX IF NOT EXISTS vacancies_name_trgm_idx '
+                            'ON vacancies USING gin (vacancy_name gin_trgm_ops)')
+                # Составной индекс по ключам сортировки списка вакансий для постраничного вывода по ключу
+                # (keyset pagination) и сортировки отчетов по зарплате без полного перебора таблицы
+                cur.execute('CREATE INDEX IF NOT EXISTS vacancies_salary_keyset_idx '
+                            'ON vacancies (salary_max DESC, vacancy_name, vacancy_id) '
+                            'WHERE salary_max IS NOT NULL AND NOT archived')
+                # Создаем материализованное представление с количеством активных вакансий по работодателям,
+                # оно пересчитывается один раз после каждой загрузки методом refresh_aggregates
+                cur.execute('CREATE MATERIALIZED VIEW IF NOT EXISTS employer_vacancy_counts AS '
+                            'SELECT employer_id, employer_name, COUNT(*) AS quantity_vacancies '
+                            'FROM vacancies '
+                            'LEFT JOIN employers USING(employer_id) '
+                            'WHERE NOT archived '
+                            'GROUP BY employer_id, employer_name')
+                # Уникальный индекс нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+                cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS employer_vacancy_counts_idx '
+                            'ON employer_vacancy_counts (employer_id)')
+                # Индекс по ключам сортировки отчета о количестве вакансий для потокового чтения
+                cur.execute('CREATE INDEX IF NOT EXISTS employer_vacancy_counts_order_idx '
+                            'ON employer_vacancy_counts (quantity_vacancies DESC, employer_name)')
+                # Прежние версии хранили в city JSON адреса вакансии (json.dumps(item['address'])), а загрузка
+                # не перезаписывает существующие строки. Переводим такие значения в название города из адреса
+                # по самим данным; в обновленной базе данных под условие не попадает ни одна строка
+                cur.execute("UPDATE vacancies SET city = NULLIF(city, 'null')::jsonb ->> 'city' "
+                            "WHERE city = 'null' OR city LIKE '{%'")
+                # Создаем материализованное представление со статистикой по максимальной зарплате:
+                # строка is_total содержит общие значения, остальные строки - значения по городам
+                cur.execute("CREATE MATERIALIZED VIEW IF NOT EXISTS salary_stats AS "
+                            "SELECT GROUPING(city_name) = 1 AS is_total, "
+                            "COALESCE(city_name, '') AS city, "
+                            "COUNT(salary_max) AS vacancies_with_salary, "
+                            "AVG(salary_max) AS avg_salary, "
+                            "percentile_cont(0.25) WITHIN GROUP (ORDER BY salary_max) AS p25, "
+                            "percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_max) AS median, "
+                            "percentile_cont(0.75) WITHIN GROUP (ORDER BY salary_max) AS p75, "
+                            "percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_max) AS p90 "
+                            "FROM (SELECT salary_max, city AS city_name "
+                            "FROM vacancies WHERE NOT archived) AS active "
+                            "GROUP BY GROUPING SETS ((city_name), ())")
+                cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS salary_stats_idx '
+                            'ON salary_stats (is_total, city)')
+                # Создаем таблицу истории: каждый снимок дописывает активные вакансии с датой обхода.
+                # Таблица секционирована по месяцам даты обхода, поэтому отчеты за период читают только
+                # нужные секции, а старые секции удаляются целиком. Внешних ключей нет: история
+                # хранит вакансии и после их удаления из таблицы vacancies
+                cur.execute('CREATE TABLE IF NOT EXISTS vacancy_snapshots '
+                            '('
+                            'crawled_on date NOT NULL, '
+                            'vacancy_id int NOT NULL, '
+                            'employer_id int NOT NULL, '
+                            'vacancy_name varchar(255) NOT NULL, '
+                            'city text, '
+                            'salary_min int, '
+                            'salary_max int, '
+                            'published_at timestamptz, '
+                            "search_keywords text[] NOT NULL DEFAULT '{}', "
+                            'PRIMARY KEY (crawled_on, vacancy_id)) '
+                            'PARTITION BY RANGE (crawled_on)')
+                # BRIN-индекс по дате обхода почти ничего не весит, так как строки дописываются по порядку дат
+                cur.execute('CREATE INDEX IF NOT EXISTS vacancy_snapshots_crawled_on_idx '
+                            'ON vacancy_snapshots USING brin (crawled_on)')
+                # Индекс для отчетов по отдельному работодателю за период
+                cur.execute('CREATE INDEX IF NOT EXISTS vacancy_snapshots_employer_idx '
+                            'ON vacancy_snapshots (employer_id, crawled_on)')
+
+    @staticmethod
+    def _add_missing_columns(cur, table, columns):
+        """Добавляет в таблицу столбцы {имя: определение}, которых в ней еще нет.
+
+        ALTER TABLE ... ADD COLUMN IF NOT EXISTS берет блокировку ACCESS EXCLUSIVE до проверки столбца
+        и держит ее до конца транзакции, поэтому на каждом sync и ingest читатели отчетов вставали бы
+        в очередь за ним. Каталог pg_attribute читается без блокировки таблицы, и ALTER выполняется,
+        только если столбца действительно нет.
+        """
+        cur.execute('SELECT attname FROM pg_attribute '
+                    'WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped', (table,))
+        existing = {name for name, in cur.fetchall()}
+        missing = [f'ADD COLUMN {name} {definition}' for name, definition in columns.items() if name not in existing]
+        if missing:
+            cur.execute(f"ALTER TABLE {table} {', '.join(missing)}")
+
+    @staticmethod
+    def _vacancy_row(item):
+        """Преобразует вакансию из ответа API в строку для таблицы vacancies"""
+        # Проверяем, есть ли у элемента данные о зарплате
+        if item.get('salary') is not None:
+            # Если да, то получаем нижнюю и верхнюю границу зарплаты из элемента
+            salary_from = item.get('salary').get('from')
+            salary_to = item.get('salary').get('to')
+        else:
+            # Если нет, то устанавливаем зарплату как None
+            salary_from = None
+            salary_to = None
+        # В city храним название региона вакансии (как HeadHunter.get_info): адрес у многих вакансий не указан
+        return (item['id'], item['name'], item['employer']['id'], (item.get('area') or {}).get('name'), salary_from,
+                salary_to, item['url'], item.get('published_at'))
+
+    @staticmethod
+    def _copy_escape(value):
+        """Экранирует значение для текстового формата COPY"""
+        # NULL в текстовом формате COPY обозначается как \N
+        if value is None:
+            return '\\N'
+        return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+    def refresh_aggregates(self):
+        """Пересчитывает материализованные представления с агрегатами для отчетов.
+
+        CONCURRENTLY позволяет читателям продолжать получать старые значения во время пересчета.
+        """
+        with self.connection() as conn, METRICS.timer('db_refresh_aggregates_seconds'):
+            with conn.cursor() as cur:
+                cur.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY employer_vacancy_counts')
+                cur.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY salary_stats')
+
+    def insert_data_into_db(self, data, bulk=True, batch_size=1000, refresh=True, keywords=None):
+        """Подключается к БД и заполняет таблицы данными из запроса.
+
+        При bulk=True работодатели дедуплицируются в памяти и загружаются пакетными upsert-ами,
+        а вакансии загружаются через COPY во временную таблицу, все в одной транзакции.
+        При refresh=True после загрузки пересчитываются агрегаты для отчетов;
+        при загрузке несколькими пакетами его стоит выключить и вызвать refresh_aggregates в конце.
+        keywords - пары (ключевое слово, vacancy_id), по которым вакансии были найдены; они
+        записываются в vacancy_keywords, чтобы отчеты по истории можно было строить по ключевому слову.
+        Возвращает словарь со статистикой загрузки (строки, секунды, строки в секунду).
+        """
+        # Засекаем время начала загрузки
+        started = time.perf_counter()
+        mode = 'bulk' if bulk else 'row_by_row'
+        with METRICS.timer('db_insert_seconds', mode=mode):
+            if bulk:
+                rows = self._bulk_insert(data['items'], batch_size, keywords)
+            else:
+                rows = self._row_by_row_insert(data['items'], keywords)
+        METRICS.inc('db_insert_rows_total', rows, mode=mode)
+        if refresh:
+            self.refresh_aggregates()
+        return load_stats(rows, started)
+
+    def _bulk_insert(self, items, batch_size, keywords=None):
+        """Загружает вакансии и работодателей пакетно в одной транзакции"""
+        # Соединение из пула фиксирует транзакцию целиком или откатывает ее при ошибке
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                return self._load(cur, items, batch_size, keywords=keywords)
+
+    def _load(self, cur, items, batch_size, update=False, keywords=None):
+        """Загружает вакансии через временную таблицу vacancies_staging в текущей транзакции.
+
+        При update=True существующие вакансии обновляются (ON CONFLICT DO UPDATE) и снимаются с архива.
+        Пары keywords (ключевое слово, vacancy_id) записываются в vacancy_keywords.
+        Временная таблица остается доступной до конца транзакции. Возвращает количество вакансий.
+        """
+        # Дедуплицируем работодателей и вакансии в памяти по идентификатору
+        employers = {}
+        vacancies = {}
+        for item in items:
+            employer = item['employer']
+            employers.setdefault(employer['id'], (employer['id'], employer['name']))
+            vacancies.setdefault(item['id'], self._vacancy_row(item))
+
+        # Вставляем работодателей многострочными INSERT-ами по batch_size строк
+        execute_values(cur,
+                       'INSERT INTO employers (employer_id, employer_name) VALUES %s '
+                       'ON CONFLICT (employer_id) DO NOTHING',
+                       list(employers.values()), page_size=batch_size)
+        # Создаем временную таблицу той же структуры, она удалится после фиксации транзакции
+        cur.execute('CREATE TEMP TABLE vacancies_staging '
+                    '(LIKE vacancies INCLUDING DEFAULTS) ON COMMIT DROP')
+        rows = list(vacancies.values())
+        # Загружаем вакансии во временную таблицу через COPY порциями по batch_size строк
+        for start in range(0, len(rows), batch_size):
+            buffer = io.StringIO()
+            for row in rows[start:start + batch_size]:
+                buffer.write('\t'.join(self._copy_escape(value) for value in row) + '\n')
+            buffer.seek(0)
+            cur.copy_expert('COPY vacancies_staging (vacancy_id, vacancy_name, employer_id, city, '
+                            'salary_min, salary_max, url, published_at) FROM STDIN', buffer)
+        if update:
+            # Обновляем изменившиеся вакансии и возвращаем в выдачу те, что снова появились
+            on_conflict = ('DO UPDATE SET vacancy_name = EXCLUDED.vacancy_name, '
+                           'employer_id = EXCLUDED.employer_id, city = EXCLUDED.city, '
+                           'salary_min = EXCLUDED.salary_min, salary_max = EXCLUDED.salary_max, '
+                           'url = EXCLUDED.url, published_at = EXCLUDED.published_at, '
+                           'archived = false, last_seen_at = now()')
+        else:
+            on_conflict = 'DO NOTHING'
+        # Переносим вакансии в основную таблицу одним запросом
+        cur.execute('INSERT INTO vacancies (vacancy_id, vacancy_name, employer_id, city, '
+                    'salary_min, salary_max, url, published_at) '
+                    'SELECT vacancy_id, vacancy_name, employer_id, city, salary_min, salary_max, url, published_at '
+                    'FROM vacancies_staging '
+                    f'ON CONFLICT (vacancy_id) {on_conflict}')
+        if keywords:
+            # Связываем вакансии с ключевыми словами, по которым они найдены
+            execute_values(cur,
+                           'INSERT INTO vacancy_keywords (search_keyword, vacancy_id) VALUES %s '
+                           'ON CONFLICT DO NOTHING',
+                           sorted(set(keywords)), page_size=batch_size)
+        return len(vacancies)
+
+    def sync(self, search_keyword, full=False, batch_size=1000, **hh_options) -> dict:
+        """Инкрементально синхронизирует вакансии по ключевому слову без пересоздания базы данных.
+
+        Запрашиваются только вакансии, опубликованные после последней синхронизации (date_from),
+        и применяются через upsert в одной транзакции, поэтому читатели не видят пустых таблиц.
+        Выдача делится на окна даты публикации (см. shard_crawler.plan_slices), чтобы обойти
+        ограничение API в 2000 результатов на запрос.
+        При full=True (и при первой синхронизации) выгружается вся выдача, а вакансии,
+        пропавшие из нее, помечаются как архивные. Если выдачу не удалось загрузить целиком,
+        вакансии не архивируются, а отметка последней синхронизации не сдвигается.
+        Параметры hh_options (например, cache и replay_only) передаются в HeadHunter.
+        """
+        started = time.perf_counter()
+        # Читаем отметку последней синхронизации по ключевому слову
+        state = self._execute_query('SELECT last_published_at FROM sync_state WHERE search_keyword = %s',
+                                    (search_keyword,), name='sync_state')
+        last_published_at = state[0][0] if state else None
+        # Без отметки делаем полную выгрузку, иначе только новые и переопубликованные вакансии
+        full = full or last_published_at is None
+        # Клиент API импортируем только здесь, чтобы отчеты не тянули за собой requests
+        from hh_parser import HeadHunter
+        from shard_crawler import plan_slices
+
+        items = []
+        complete = True
+        for filters in plan_slices(search_keyword, date_from=None if full else last_published_at, **hh_options):
+            hh = HeadHunter(search_keyword, filters=filters, **hh_options)
+            pages = list(hh.iter_pages())
+            slice_items = [item for page in pages for item in page.get('items', [])]
+            # В окне оказалось больше вакансий, чем отдает API: выдача загружена не полностью
+            if pages[0].get('found', 0) > len(slice_items):
+                complete = False
+            items.extend(slice_items)
+
+        archived = 0
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                rows = self._load(cur, items, batch_size, update=True)
+                # Запоминаем, какие вакансии найдены по этому ключевому слову
+                cur.execute('INSERT INTO vacancy_keywords (search_keyword, vacancy_id) '
+                            'SELECT %s, vacancy_id FROM vacancies_staging '
+                            'ON CONFLICT DO NOTHING', (search_keyword,))
+                if full and complete:
+                    # Вакансии ключевого слова, которых нет в полной выдаче, помечаем как архивные
+                    cur.execute('UPDATE vacancies SET archived = true '
+                                'WHERE NOT archived '
+                                'AND vacancy_id IN (SELECT vacancy_id FROM vacancy_keywords WHERE search_keyword = %s) '
+                                'AND vacancy_id NOT IN (SELECT vacancy_id FROM vacancies_staging)',
+                                (search_keyword,))
+                    archived = cur.rowcount
+                # Сдвигаем отметку на самую позднюю дату публикации из выдачи; при неполной выдаче
+                # оставляем прежнюю, чтобы пропущенные вакансии попали в следующую синхронизацию
+                cur.execute('INSERT INTO sync_state (search_keyword, last_published_at, last_synced_at) '
+                            'VALUES (%s, CASE WHEN %s THEN (SELECT MAX(published_at) FROM vacancies_staging) END, '
+                            'now()) '
+                            'ON CONFLICT (search_keyword) DO UPDATE SET '
+                            'last_published_at = CASE WHEN %s THEN GREATEST(sync_state.last_published_at, '
+                            'EXCLUDED.last_published_at) ELSE sync_state.last_published_at END, '
+                            'last_synced_at = EXCLUDED.last_synced_at',
+                            (search_keyword, complete, complete))
+        # Пересчитываем агрегаты для отчетов после применения изменений
+        self.refresh_aggregates()
+        return {'rows': rows,
+                'archived': archived,
+                'full': full,
+                'complete': complete,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    @staticmethod
+    def _employer_row(employer_id, details):
+        """Преобразует данные работодателя из /employers/{id} в строку для таблицы employers"""
+        return (employer_id,
+                details.get('type'),
+                details.get('site_url'),
+                details.get('alternate_url'),
+                (details.get('area') or {}).get('name'),
+                [industry.get('name') for industry in details.get('industries') or []],
+                details.get('trusted'),
+                details.get('open_vacancies'))
+
+    def enrich_employers(self, max_age_days=7, batch_size=100, hh=None) -> dict:
+        """Дозапрашивает подробные данные работодателей, у которых есть вакансии в базе данных.
+
+        Пропускаются работодатели, уже обработанные в этом процессе, и работодатели, данные которых
+        получены менее max_age_days дней назад. Запросы выполняются параллельно с ограничением частоты
+        (см. HeadHunter), а результаты пакетами по batch_size записываются в таблицу employers.
+        """
+        started = time.perf_counter()
+        # Выбираем работодателей, данных о которых нет или они устарели
+        stale = self._execute_query('SELECT DISTINCT employer_id '
+                                    'FROM vacancies '
+                                    'JOIN employers USING(employer_id) '
+                                    'WHERE details_fetched_at IS NULL '
+                                    "OR details_fetched_at < now() - %s * interval '1 day'",
+                                    (max_age_days,), name='stale_employers')
+        employer_ids = [row[0] for row in stale if row[0] not in self._enriched_employers]
+        # Клиент API импортируем только здесь, чтобы отчеты не тянули за собой requests
+        from hh_parser import HeadHunter
+        from pipeline import iter_batches
+
+        hh = hh or HeadHunter()
+
+        updated = 0
+        missing = 0
+        for batch in iter_batches(hh.iter_employers(employer_ids), batch_size):
+            rows = [self._employer_row(employer_id, details) for employer_id, details in batch if details]
+            missing += len(batch) - len(rows)
+            with self.connection() as conn:
+                with conn.cursor() as cur:
+                    # Обновляем данные работодателей одним многострочным запросом
+                    execute_values(cur,
+                                   'UPDATE employers SET '
+                                   'employer_type = data.employer_type, site_url = data.site_url, '
+                                   'alternate_url = data.alternate_url, area = data.area, '
+                                   'industries = data.industries, trusted = data.trusted, '
+                                   'open_vacancies = data.open_vacancies, details_fetched_at = now() '
+                                   'FROM (VALUES %s) AS data (employer_id, employer_type, site_url, alternate_url, '
+                                   'area, industries, trusted, open_vacancies) '
+                                   'WHERE employers.employer_id = data.employer_id',
+                                   rows, template='(%s, %s, %s, %s, %s, %s::text[], %s::boolean, %s::int)',
+                                   page_size=batch_size)
+                    # Работодателей, которых больше нет в API, тоже отмечаем, чтобы не запрашивать их снова
+                    cur.execute('UPDATE employers SET details_fetched_at = now() WHERE employer_id = ANY(%s)',
+                                ([employer_id for employer_id, details in batch if not details],))
+            updated += len(rows)
+            self._enriched_employers.update(employer_id for employer_id, _ in batch)
+        return {'employers': updated,
+                'missing': missing,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    @staticmethod
+    def _snapshot_partition(day):
+        """Возвращает имя и границы [начало, конец) месячной секции vacancy_snapshots для даты day"""
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        return f'vacancy_snapshots_{start:%Y_%m}', start, end
+
+    def record_snapshot(self, crawled_on=None) -> dict:
+        """Дописывает активные вакансии в историю vacancy_snapshots с датой обхода crawled_on.
+
+        По умолчанию используется сегодняшняя дата. Секция нужного месяца создается при первой
+        записи в нее. Повторный снимок за ту же дату заменяет значения вакансий, а не дублирует их.
+        Ключевые слова берутся из vacancy_keywords (заполняется при загрузке и методом sync).
+        """
+        started = time.perf_counter()
+        crawled_on = crawled_on or date.today()
+        partition, start, end = self._snapshot_partition(crawled_on)
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f'CREATE TABLE IF NOT EXISTS {partition} PARTITION OF vacancy_snapshots '
+                            'FOR VALUES FROM (%s) TO (%s)', (start, end))
+                # Копируем снимок одним запросом на стороне сервера, без передачи строк клиенту
+                cur.execute("INSERT INTO vacancy_snapshots (crawled_on, vacancy_id, employer_id, vacancy_name, "
+                            "city, salary_min, salary_max, published_at, search_keywords) "
+                            "SELECT %s, vacancy_id, employer_id, vacancy_name, city, "
+                            "salary_min, salary_max, published_at, COALESCE(keywords.search_keywords, '{}') "
+                            "FROM vacancies "
+                            "LEFT JOIN (SELECT vacancy_id, array_agg(search_keyword ORDER BY search_keyword) "
+                            "AS search_keywords FROM vacancy_keywords GROUP BY vacancy_id) AS keywords "
+                            "USING(vacancy_id) "
+                            "WHERE NOT archived "
+                            "ON CONFLICT (crawled_on, vacancy_id) DO UPDATE SET "
+                            "employer_id = EXCLUDED.employer_id, vacancy_name = EXCLUDED.vacancy_name, "
+                            "city = EXCLUDED.city, salary_min = EXCLUDED.salary_min, "
+                            "salary_max = EXCLUDED.salary_max, published_at = EXCLUDED.published_at, "
+                            "search_keywords = EXCLUDED.search_keywords",
+                            (crawled_on,))
+                rows = cur.rowcount
+        METRICS.inc('db_snapshot_rows_total', rows)
+        return {'crawled_on': crawled_on.isoformat(),
+                'partition': partition,
+                'rows': rows,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    def apply_snapshot_retention(self, keep_days=365) -> list:
+        """Удаляет секции истории, все даты которых старше keep_days дней.
+
+        Секция сначала отсоединяется от vacancy_snapshots, а затем удаляется целиком: это быстрее
+        DELETE по миллионам строк и не оставляет мертвых строк для VACUUM.
+        Возвращает имена удаленных секций.
+        """
+        cutoff = date.today() - timedelta(days=keep_days)
+        partitions = self._execute_query("SELECT child.relname "
+                                         "FROM pg_inherits "
+                                         "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                                         "WHERE pg_inherits.inhparent = 'vacancy_snapshots'::regclass "
+                                         "ORDER BY child.relname", name='snapshot_partitions')
+        dropped = []
+        for (partition,) in partitions:
+            month = re.fullmatch(r'vacancy_snapshots_(\d{4})_(\d{2})', partition)
+            # Секции, созданные вручную под другим именем, не трогаем
+            if month is None:
+                continue
+            _, _, end = self._snapshot_partition(date(int(month.group(1)), int(month.group(2)), 1))
+            if end > cutoff:
+                continue
+            with self.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f'ALTER TABLE vacancy_snapshots DETACH PARTITION {partition}')
+                    cur.execute(f'DROP TABLE {partition}')
+            dropped.append(partition)
+        return dropped
+
+    def _row_by_row_insert(self, items, keywords=None):
+        """Построчно вставляет вакансии и работодателей (медленный режим, коммит после каждой строки)"""
+        # Получаем соединение из пула
+        with self.connection() as conn:
             with conn.cursor() as cur:
-                # Включаем автоматическое подтверждение транзакций
-                conn.autocommit = True
-                # Создаем объект курсора для выполнения SQL-запросов
-                cur = conn.cursor()
                 # Цикл по элементам данных из запроса
-                for item in data['items']:
+                for item in items:
                     # Получаем данные о работодателе из элемента
                     employer = item['employer']
                     # Выполняем SQL-запрос для вставки данных о работодателе в таблицу employers
@@ -90,104 +723,261 @@ class DBManager:
                     # Подтверждаем транзакцию
                     conn.commit()
 
-                    # Проверяем, есть ли у элемента данные о зарплате
-                    if item.get('salary') is not None:
-                        # Если да, то получаем нижнюю и верхнюю границу зарплаты из элемента
-                        salary_from = item.get('salary').get('from')
-                        salary_to = item.get('salary').get('to')
-                    else:
-                        # Если нет, то устанавливаем зарплату как None
-                        salary_from = None
-                        salary_to = None
-
                     # Выполняем SQL-запрос для вставки данных о вакансии в таблицу vacancies
                     # Используем ON CONFLICT DO NOTHING для предотвращения дублирования данных
                     cur.execute("""
-                        INSERT INTO vacancies (vacancy_id, vacancy_name, employer_id, city, salary_min, salary_max, url)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        INSERT INTO vacancies (vacancy_id, vacancy_name, employer_id, city, salary_min, salary_max, url,
+                                               published_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                         ON CONFLICT (vacancy_id) DO NOTHING;
-                    """, (item['id'], item['name'], item['employer']['id'], json.dumps(item['address']), salary_from,
-                          salary_to, item['url']))
+                    """, self._vacancy_row(item))
                     # Подтверждаем транзакцию
                     conn.commit()
+                # Связываем вакансии с ключевыми словами, по которым они найдены
+                for search_keyword, vacancy_id in keywords or ():
+                    cur.execute('INSERT INTO vacancy_keywords (search_keyword, vacancy_id) VALUES (%s, %s) '
+                                'ON CONFLICT DO NOTHING', (search_keyword, vacancy_id))
+                    conn.commit()
+        return len(items)
 
-    def _execute_query(self, query) -> list:
-        """Возвращает результат запроса"""
-        # Подключаемся к базе данных с помощью библиотеки psycopg2
-        conn = psycopg2.connect(dbname=self.dbname, **self.params)
-        try:
-            # Используем менеджеры контекста для автоматического закрытия соединения и курсора
-            with conn:
-                with conn.cursor() as cur:
-                    # Выполняем SQL-запрос и получаем результат
-                    cur.execute(query)
+    def _execute_query(self, query, params=None, name='adhoc') -> list:
+        """Возвращает результат запроса; name используется как метка в метриках"""
+        # Получаем соединение из пула, транзакция фиксируется при выходе из блока
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                # Выполняем SQL-запрос и получаем результат
+                with METRICS.timer('db_query_seconds', query=name):
+                    cur.execute(query, params)
                     result = cur.fetchall()
-
-        finally:
-            # Закрываем соединение с базой данных (необязательно, так как менеджер контекста это делает автоматически)
-            conn.close()
+        METRICS.inc('db_query_rows_total', len(result), query=name)
 
         # Возвращаем результат запроса в виде списка кортежей
         return result
 
+    def _iter_query(self, query, params=None, itersize=2000):
+        """Возвращает строки результата по одной через серверный (именованный) курсор.
+
+        Строки передаются с сервера порциями по itersize, поэтому в памяти процесса никогда
+        не находится весь результат. Соединение из пула занято, пока итерация не закончится.
+        """
+        with self.connection() as conn:
+            # Именованный курсор открывается на сервере, имя должно быть уникальным в рамках соединения
+            with conn.cursor(name=f'stream_{uuid.uuid4().hex}') as cur:
+                cur.itersize = itersize
+                cur.execute(query, params)
+                yield from cur
+
+    @staticmethod
+    def _encode_cursor(values) -> str:
+        """Упаковывает ключ последней строки страницы в непрозрачную строку"""
+        return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode('UTF-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        """Распаковывает ключ последней строки страницы из строки, полученной от _encode_cursor"""
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('UTF-8'))
+
+    def _execute_prepared(self, conn, name, args=()) -> list:
+        """Выполняет отчетный запрос как подготовленный на сервере (PREPARE/EXECUTE) в рамках соединения"""
+        with conn.cursor() as cur:
+            # Подготавливаем запрос один раз на соединение, повторные вызовы пропускают разбор и планирование
+            if name not in conn.prepared:
+                cur.execute(f'PREPARE {name} AS {self.REPORT_QUERIES[name]}')
+                conn.prepared.add(name)
+            with METRICS.timer('db_query_seconds', query=name):
+                if args:
+                    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args)
+                else:
+                    cur.execute(f'EXECUTE {name}')
+                result = cur.fetchall()
+        METRICS.inc('db_query_rows_total', len(result), query=name)
+        return result
+
+    def _run_report(self, name, args=()) -> list:
+        """Выполняет один отчетный запрос на соединении из пула"""
+        with self.connection() as conn:
+            return self._execute_prepared(conn, name, args)
+
+    def run_reports(self, word: str) -> dict:
+        """Выполняет все отчеты на одном соединении в одном согласованном снимке данных.
+
+        Возвращает словарь с результатами по именам отчетов.
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                # Первый запрос транзакции фиксирует снимок: все отчеты видят одни и те же данные
+                cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            return {
+                'companies_and_vacancies_count': self._execute_prepared(conn, 'companies_and_vacancies_count'),
+                'all_vacancies': self._execute_prepared(conn, 'all_vacancies'),
+                'avg_salary': self._execute_prepared(conn, 'avg_salary'),
+                'vacancies_with_higher_salary': self._execute_prepared(conn, 'vacancies_with_higher_salary'),
+                'vacancies_with_keyword': self._execute_prepared(conn, 'vacancies_with_keyword', (word,)),
+            }
+
     def get_companies_and_vacancies_count(self) -> list:
         # Выполняем SQL-запрос для получения названий компаний и количества вакансий по каждой компании
-        # Используем LEFT JOIN для объединения таблиц vacancies и employers по идентификатору работодателя
-        # Используем GROUP BY для группировки результатов по названию компании
+        # Количество вакансий заранее посчитано в материализованном представлении employer_vacancy_counts
         # Используем ORDER BY для сортировки результатов по убыванию количества вакансий и по алфавиту названия компаний
-        result = self._execute_query("SELECT employer_name, COUNT(*) as quantity_vacancies "
-                                     "FROM vacancies "
-                                     "LEFT JOIN employers USING(employer_id)"
-                                     "GROUP BY employer_name "
-                                     "ORDER BY quantity_vacancies DESC, employer_name")
+        result = self._run_report('companies_and_vacancies_count')
         # Возвращаем результат запроса в виде списка кортежей
         return result
 
+    def iter_companies_and_vacancies_count(self, itersize: int = 2000):
+        """Потоково возвращает те же строки, что и get_companies_and_vacancies_count"""
+        return self._iter_query(self.REPORT_QUERIES['companies_and_vacancies_count'], itersize=itersize)
+
     def get_all_vacancies(self) -> list:
         # Выполняем SQL-запрос для получения названий компаний, названий вакансий, максимальной зарплаты и URL вакансий
         # Используем JOIN для объединения таблиц vacancies и employers по идентификатору работодателя
         # Используем WHERE для фильтрации результатов по наличию максимальной зарплаты
         # Используем ORDER BY для сортировки результатов по убыванию максимальной зарплаты и по алфавиту названия вакансий
-        result = self._execute_query("SELECT employers.employer_name, vacancy_name, salary_max, url "
-                                     "FROM vacancies "
-                                     "JOIN employers USING(employer_id)"
-                                     "WHERE salary_max IS NOT NULL "
-                                     "ORDER BY salary_max DESC, vacancy_name")
+        result = self._run_report('all_vacancies')
         # Возвращаем результат запроса в виде списка кортежей
         return result
 
+    def iter_all_vacancies(self, itersize: int = 2000):
+        """Потоково возвращает те же строки, что и get_all_vacancies, не загружая их в память целиком"""
+        return self._iter_query(self.REPORT_QUERIES['all_vacancies'], itersize=itersize)
+
+    def get_all_vacancies_page(self, page_size: int = 50, cursor: str = None) -> tuple:
+        """Возвращает страницу списка всех вакансий и курсор следующей страницы.
+
+        Страницы выбираются по ключу (salary_max, vacancy_name, vacancy_id), а не через OFFSET,
+        поэтому время получения любой страницы не зависит от ее номера. Курсор - непрозрачная строка;
+        для первой страницы передается None, после последней страницы возвращается None.
+        """
+        if cursor is None:
+            rows = self._run_report('all_vacancies_first_page', (page_size,))
+        else:
+            salary_max, vacancy_name, vacancy_id = self._decode_cursor(cursor)
+            rows = self._run_report('all_vacancies_next_page', (salary_max, vacancy_name, vacancy_id, page_size))
+        next_cursor = None
+        if len(rows) == page_size:
+            # Ключ последней строки становится курсором следующей страницы
+            _, vacancy_name, salary_max, _, vacancy_id = rows[-1]
+            next_cursor = self._encode_cursor([salary_max, vacancy_name, vacancy_id])
+        # Убираем служебный vacancy_id, чтобы строки совпадали с get_all_vacancies
+        return [row[:4] for row in rows], next_cursor
+
     def get_avg_salary(self) -> list:
         # Выполняем SQL-запрос для получения среднего значения максимальной зарплаты по всем вакансиям
-        # Используем функцию AVG для вычисления среднего арифметического
+        # Среднее значение заранее посчитано в материализованном представлении salary_stats
         # Используем функцию ROUND для округления результата до целого числа
-        result = self._execute_query("SELECT ROUND(AVG(salary_max)) as average_salary "
-                                     "FROM vacancies")
+        result = self._run_report('avg_salary')
         # Возвращаем результат запроса в виде списка кортежей
         return result
 
     def get_vacancies_with_higher_salary(self) -> list:
         # Выполняем SQL-запрос для получения названий вакансий и максимальной зарплаты по вакансиям с зарплатой выше средней
-        # Используем WHERE для фильтрации результатов по условию salary_max > (SELECT AVG(salary_max) FROM vacancies)
+        # Используем WHERE для фильтрации результатов по условию salary_max больше средней зарплаты,
+        # которая заранее посчитана в материализованном представлении salary_stats
         # Используем ORDER BY для сортировки результатов по убыванию максимальной зарплаты и по алфавиту названия вакансий
-        result = self._execute_query("SELECT vacancy_name, salary_max "
-                                     "FROM vacancies "
-                                     "WHERE salary_max > (SELECT AVG(salary_max) FROM vacancies) "
-                                     "ORDER BY salary_max DESC, vacancy_name")
+        result = self._run_report('vacancies_with_higher_salary')
         # Возвращаем результат запроса в виде списка кортежей
         return result
 
     def get_vacancies_with_keyword(self, word: str) -> list:
         # Выполняем SQL-запрос для получения названий вакансий, содержащих заданное слово
-        # Используем WHERE для фильтрации результатов по условию vacancy_name ILIKE '%{word}%'
+        # Используем WHERE для фильтрации результатов по условию vacancy_name ILIKE '%' || $1 || '%'
         # ILIKE означает регистронезависимое сравнение строк с использованием шаблона
-        # % означает любое количество любых символов
-        result = self._execute_query("SELECT vacancy_name "
-                                     "FROM vacancies "
-                                     f"WHERE vacancy_name ILIKE '%{word}%'"
-                                     "ORDER BY vacancy_name")
+        # Слово передается параметром подготовленного запроса, а не подставляется в текст SQL
+        # Поиск по подстроке обслуживается триграммным индексом vacancies_name_trgm_idx
+        result = self._run_report('vacancies_with_keyword', (word,))
         # Возвращаем результат запроса в виде списка кортежей
         return result
 
+    def get_salary_stats(self, by_city: bool = False) -> list:
+        """Возвращает статистику по максимальной зарплате: количество, среднее и перцентили.
+
+        При by_city=True возвращаются строки по каждому городу, иначе одна общая строка.
+        Кортежи имеют вид (city, vacancies_with_salary, avg_salary, p25, median, p75, p90).
+        """
+        result = self._run_report('salary_stats', (by_city,))
+        return result
+
+    def search_vacancies(self, query: str, limit: int = 20, page: int = 0) -> list:
+        """Ищет вакансии по названию и возвращает страницу результатов, отсортированных по релевантности.
+
+        Запрос может состоять из нескольких слов и поддерживает синтаксис websearch_to_tsquery
+        (кавычки, OR, минус). Совпадения ищутся по полнотекстовому индексу с русской и английской
+        морфологией. Если он ничего не нашел, а в запросе нет операторов, вакансии ищутся
+        по триграммам, чтобы находить опечатки и части слов; rank тогда равен word_similarity.
+        Возвращает список кортежей (vacancy_id, vacancy_name, salary_max, url, rank).
+        """
+        # Операторы websearch: кавычки, минус перед словом и OR
+        fuzzy = re.search(r'"|(^|\s)-|\bor\b', query, re.IGNORECASE) is None
+        result = self._run_report('search_vacancies', (query, limit, page * limit, fuzzy))
+        return result
+
+    @staticmethod
+    def _trend_period(date_from, date_to):
+        """Возвращает период [date_from, date_to) отчетов по истории; по умолчанию последние 13 недель"""
+        date_to = date_to or date.today() + timedelta(days=1)
+        date_from = date_from or date_to - timedelta(weeks=13)
+        return date_from, date_to
+
+    def get_salary_trend(self, search_keyword: str = None, date_from: date = None, date_to: date = None) -> list:
+        """Возвращает статистику по максимальной зарплате за каждую неделю периода [date_from, date_to).
+
+        Вакансия учитывается в неделе один раз, по последнему снимку за эту неделю. При заданном
+        search_keyword учитываются только вакансии, найденные по этому ключевому слову.
+        Кортежи имеют вид (week, vacancies, vacancies_with_salary, avg_salary, p25, median, p75, p90).
+        """
+        date_from, date_to = self._trend_period(date_from, date_to)
+        # Даты подставляются в текст запроса на клиенте, поэтому планировщик еще при планировании
+        # отбрасывает секции вне периода; у подготовленного запроса это происходило бы только при выполнении
+        result = self._execute_query("SELECT week, COUNT(*) AS vacancies, "
+                                     "COUNT(salary_max) AS vacancies_with_salary, "
+                                     "ROUND(AVG(salary_max)) AS avg_salary, "
+                                     "percentile_cont(0.25) WITHIN GROUP (ORDER BY salary_max) AS p25, "
+                                     "percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_max) AS median, "
+                                     "percentile_cont(0.75) WITHIN GROUP (ORDER BY salary_max) AS p75, "
+                                     "percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_max) AS p90 "
+                                     "FROM (SELECT DISTINCT ON (1, vacancy_id) "
+                                     "date_trunc('week', crawled_on)::date AS week, salary_max "
+                                     "FROM vacancy_snapshots "
+                                     "WHERE crawled_on >= %(date_from)s AND crawled_on < %(date_to)s "
+                                     "AND (%(search_keyword)s::text IS NULL "
+                                     "OR %(search_keyword)s = ANY(search_keywords)) "
+                                     "ORDER BY 1, vacancy_id, crawled_on DESC) AS weekly "
+                                     "GROUP BY week "
+                                     "ORDER BY week",
+                                     {'date_from': date_from, 'date_to': date_to, 'search_keyword': search_keyword},
+                                     name='salary_trend')
+        return result
+
+    def get_employer_salary_trend(self, employer_id: int = None, search_keyword: str = None,
+                                  date_from: date = None, date_to: date = None) -> list:
+        """Возвращает статистику по максимальной зарплате работодателей за каждую неделю периода.
+
+        При заданном employer_id отчет строится по одному работодателю через индекс
+        (employer_id, crawled_on), при заданном search_keyword - только по вакансиям,
+        найденным по этому ключевому слову. Кортежи имеют вид
+        (employer_id, employer_name, week, vacancies, avg_salary, median, p90).
+        """
+        date_from, date_to = self._trend_period(date_from, date_to)
+        result = self._execute_query("SELECT employer_id, employer_name, week, COUNT(*) AS vacancies, "
+                                     "ROUND(AVG(salary_max)) AS avg_salary, "
+                                     "percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_max) AS median, "
+                                     "percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_max) AS p90 "
+                                     "FROM (SELECT DISTINCT ON (1, vacancy_id) "
+                                     "date_trunc('week', crawled_on)::date AS week, vacancy_id, "
+                                     "employer_id, salary_max "
+                                     "FROM vacancy_snapshots "
+                                     "WHERE crawled_on >= %(date_from)s AND crawled_on < %(date_to)s "
+                                     "AND (%(employer_id)s::int IS NULL OR employer_id = %(employer_id)s) "
+                                     "AND (%(search_keyword)s::text IS NULL "
+                                     "OR %(search_keyword)s = ANY(search_keywords)) "
+                                     "ORDER BY 1, vacancy_id, crawled_on DESC) AS weekly "
+                                     "LEFT JOIN employers USING(employer_id) "
+                                     "GROUP BY employer_id, employer_name, week "
+                                     "ORDER BY employer_name, employer_id, week",
+                                     {'date_from': date_from, 'date_to': date_to, 'employer_id': employer_id,
+                                      'search_keyword': search_keyword},
+                                     name='employer_salary_trend')
+        return result
+
 if __name__ == '__main__':
     # Получаем параметры подключения к базе данных из файла config.py
     params = config()
@@ -1,137 +1,299 @@
 import json
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import ReplayMiss
+from metrics import METRICS
+
+# Коды ответа, при которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Ограничивает частоту запросов по алгоритму token bucket (потокобезопасно)"""
+
+    def __init__(self, rate, capacity=None):
+        # Скорость пополнения корзины в токенах в секунду
+        self.rate = rate
+        # Максимальное количество токенов (размер "всплеска" запросов)
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        # Изначально корзина полная
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Блокирует поток, пока в корзине не появится свободный токен"""
+        # Нулевая или отрицательная скорость означает отсутствие ограничения
+        if not self.rate or self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # Пополняем корзину пропорционально прошедшему времени
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    # Забираем токен и разрешаем запрос
+                    self.tokens -= 1
+                    return
+                # Считаем, сколько ждать до появления следующего токена
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 
 class HeadHunter:
     # Константа для хранения базового URL API
     URL = f'https://api.hh.ru/vacancies'
+    # URL для запроса подробных данных о работодателе
+    EMPLOYER_URL = 'https://api.hh.ru/employers'
 
-    def __init__(self, search_keyword):
+    def __init__(self, search_keyword='', max_workers=4, rate_limit=5.0, max_retries=3, backoff=0.5, timeout=10,
+                 cache=None, replay_only=False, filters=None):
         # Инициализируем параметры запроса с ключевым словом поиска
         self.params = {'text': f'{search_keyword}',
                        'page': 0,
                        'per_page': 100}
+        # Дополнительные фильтры поиска API (area, date_from, date_to и т.п.)
+        if filters:
+            self.params.update(filters)
+        # Максимальное количество одновременных запросов к API
+        self.max_workers = max_workers
+        # Ограничитель частоты запросов (запросов в секунду) общий для всех потоков
+        self.rate_limiter = TokenBucket(rate_limit)
+        # Количество повторных попыток при ответах 429/5xx и сетевых ошибках
+        self.max_retries = max_retries
+        # Базовая задержка экспоненциального backoff в секундах
+        self.backoff = backoff
+        # Таймаут одного запроса в секундах
+        self.timeout = timeout
+        # Общая сессия с пулом keep-alive соединений, размер пула равен числу потоков
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, max_workers))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Дисковый кэш ответов (http_cache.ResponseCache) или None, если кэширование не нужно
+        self.cache = cache
+        # В режиме воспроизведения ответы берутся только из кэша, сеть не используется
+        self.replay_only = replay_only
+        if replay_only and cache is None:
+            raise ValueError('replay_only mode requires a response cache')
+
+    @staticmethod
+    def _cached_response(url, entry):
+        """Создает объект ответа requests из записи кэша"""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = 'UTF-8'
+        response._content = entry['body'].encode('UTF-8')
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
+    def _send(self, url, params=None):
+        """Отправляет GET-запрос через кэш: свежие записи отдаются без сети, устаревшие перепроверяются"""
+        if self.cache is None:
+            return self._fetch(url, params)
+        entry = self.cache.get(url, params)
+        if self.replay_only:
+            # Без сети отдаем запись любой давности, а отсутствие записи считаем ошибкой
+            if entry is None:
+                raise ReplayMiss(f'No recorded response for {url} {self.cache.normalize_params(params)}')
+            METRICS.inc('http_cache_total', result='replay')
+            return self._cached_response(url, entry)
+        if entry is not None and self.cache.is_fresh(entry):
+            METRICS.inc('http_cache_total', result='hit')
+            return self._cached_response(url, entry)
+        # Для устаревшей записи отправляем условный запрос с валидаторами, если сервер их присылал
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = self._fetch(url, params, headers)
+        if response.status_code == 304 and entry is not None:
+            # Данные не изменились: продлеваем запись и отдаем ее
+            METRICS.inc('http_cache_total', result='revalidated')
+            return self._cached_response(url, self.cache.touch(url, params, entry))
+        METRICS.inc('http_cache_total', result='miss')
+        if response.status_code == 200:
+            self.cache.put(url, params, response.text, response.headers)
+        return response
+
+    def _fetch(self, url, params=None, headers=None):
+        """Отправляет GET-запрос с учетом ограничения частоты и повторяет его при 429/5xx"""
+        response = None
+        for attempt in range(self.max_retries + 1):
+            # Ждем свободный токен перед каждой попыткой
+            self.rate_limiter.acquire()
+            if attempt:
+                METRICS.inc('http_retries_total')
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                METRICS.inc('http_errors_total', error=type(error).__name__)
+                # Сетевую ошибку на последней попытке пробрасываем выше
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            # Считаем запросы по кодам ответа, время ответа и объем полученных данных
+            METRICS.observe('http_request_seconds', time.perf_counter() - started)
+            METRICS.inc('http_requests_total', status=response.status_code)
+            METRICS.inc('http_response_bytes_total', len(response.content))
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                break
+            # Если сервер указал Retry-After, ждем столько, сколько он просит
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = int(retry_after)
+            else:
+                delay = self.backoff * 2 ** attempt
+            time.sleep(delay)
+        return response
 
     def get_request(self):
         # Отправляем GET-запрос к API и проверяем статус ответа
-        response = requests.get(self.URL, self.params)
+        response = self._send(self.URL, self.params)
         if response.status_code == 200:
             # Преобразуем ответ в JSON-формат и возвращаем данные
             data = response.json()
             return data
 
+    def get_page(self, page):
+        """Возвращает данные одной страницы результатов поиска"""
+        # Копируем параметры, чтобы потоки не изменяли общий словарь
+        params = dict(self.params, page=page)
+        response = self._send(self.URL, params)
+        # Если все попытки исчерпаны, выбрасываем исключение, а не теряем страницу молча
+        response.raise_for_status()
+        with METRICS.timer('json_parse_seconds'):
+            return response.json()
 
-def get_request_company(self):
-    # Формируем URL для запроса по компаниям
-    url = 'https://api.hh.ru/vacancies?text=' + search_keyword
-    # Создаем пустой список для хранения идентификаторов компаний
-    company_id = []
-    # Цикл по 15 страницам результатов
-    for item in range(15):
-        # Получаем список вакансий по ключевому слову и преобразуем в JSON-формат
-        request_hh = requests.get(url, params={"keywords": search_keyword}).json()['items']
-        # Делаем паузу в полсекунды, чтобы не перегрузить сервер
-        time.sleep(0.5)
-        # Цикл по вакансиям на странице
-        for item2 in request_hh:
-            # Если список компаний достиг максимального размера, прерываем цикл
-            if len(company_id) == 15:
-                break
-            # Добавляем идентификатор компании в список, если он еще не там
-            company_id.add(item2['employer']['id'])
-    # Возвращаем список идентификаторов компаний
-    return company_id
-
-
-def get_employers(self):
-    # Создаем пустой список для хранения работодателей
-    employers = []
-    # Получаем данные от API с помощью метода get_request
-    data = self.get_request()
-    # Получаем список вакансий из данных
-    items = data.get('items')
-    # Цикл по первым 15 вакансиям
-    for item in items[:15]:
-        # Проверяем, что у вакансии есть идентификатор и название работодателя
-        if item.get('employer').get('id') != 0 and item.get('employer').get('name') != 0:
-            # Добавляем кортеж с идентификатором и названием работодателя в список
-            employers.append((item.get('employer').get('id'),
-                              item.get('employer').get('name')))
-        # Удаляем дубликаты из списка работодателей с помощью преобразования в множество и обратно в список
-        unigue_employers = list(set(employers))
-    # Сохраняем список работодателей в файле JSON с красивым форматированием и поддержкой кириллицы
-    with open('employers.json', 'w', encoding="UTF-8") as file:
-        json.dump(unigue_employers, file, indent=4, ensure_ascii=False)
-    # Возвращаем список работодателей
-    return unigue_employers
-
-@staticmethod
-def get_info(data):
-    # Получаем идентификатор вакансии из данных и преобразуем его в целое число
-    vacancy_id = int(data.get('id'))
-    # Получаем название вакансии из данных
-    name = data['name']
-    # Получаем идентификатор работодателя из данных и преобразуем его в целое число
-    employer_id = int(data.get('employer').get('id'))
-    # Получаем название города из данных
-    city = data.get('area').get('name')
-    # Получаем URL вакансии из данных
-    url = data.get('alternate_url')
-
-    # Инициализируем зарплату как None
-    salary = None
-    # Проверяем, есть ли у вакансии зарплата и валюта
-    if data.get('salary') and data.get('salary').get('currency') == "RUR":
-        # Если валюта рубли, то получаем нижнюю границу зарплаты из данных
-        salary = data.get('salary').get('from')
-
-    # Создаем кортеж с данными о вакансии
-    vacancy = (vacancy_id, name, employer_id, city, salary, url)
-    # Возвращаем кортеж
-    return vacancy
-
-
-def get_vacancies(self):
-    # Создаем пустой список для хранения вакансий
-    vacancies = []
-    # Инициализируем номер страницы как 0
-    page = 0
-    # Запускаем бесконечный цикл
-    while True:
-        # Устанавливаем номер страницы в параметрах запроса
-        self.params['page'] = page
-        # Получаем данные от API с помощью метода get_request
-        data = self.get_request()
-        # Цикл по вакансиям в данных
-        for vacancy in data.get('items'):
-            # Проверяем, есть ли у вакансии зарплата и валюта
-            if vacancy.get('salary') is not None and vacancy.get('salary').get('currency') is not None:
-                # Если валюта рубли, то добавляем данные о вакансии в список с помощью метода get_info
-                if vacancy.get('salary').get('currency') == "RUR":
-                    vacancies.append(self.get_info(vacancy))
-                else:
-                    # Если валюта не рубли, то пропускаем вакансию
-                    continue
-            else:
-                # Если у вакансии нет зарплаты или валюты, то добавляем данные о вакансии в список с помощью метода get_info
+    def iter_pages(self, concurrent=True):
+        """Возвращает данные всех страниц результатов в порядке их номеров"""
+        # Первая страница нужна, чтобы узнать общее количество страниц
+        first = self.get_page(0)
+        yield first
+        pages = range(1, first.get('pages', 1))
+        yield from self._map(self.get_page, pages, concurrent)
+
+    def _map(self, func, args, concurrent=True):
+        """Применяет func к каждому аргументу и возвращает результаты в исходном порядке.
+
+        В параллельном режиме в работе находится не больше max_workers * 2 запросов,
+        чтобы медленный потребитель не накапливал в памяти все результаты.
+        """
+        if not concurrent or self.max_workers <= 1:
+            # Последовательный режим: запросы выполняются по одному
+            for arg in args:
+                yield func(arg)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            try:
+                for arg in args:
+                    pending.append(executor.submit(func, arg))
+                    if len(pending) >= self.max_workers * 2:
+                        # Отдаем результаты строго в порядке аргументов
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # Если потребитель остановился раньше, отменяем еще не начатые запросы
+                for future in pending:
+                    future.cancel()
+
+    def get_employer(self, employer_id):
+        """Возвращает подробные данные о работодателе или None, если работодатель не найден"""
+        response = self._send(f'{self.EMPLOYER_URL}/{employer_id}')
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        with METRICS.timer('json_parse_seconds'):
+            return response.json()
+
+    def iter_employers(self, employer_ids, concurrent=True):
+        """Параллельно запрашивает данные работодателей с учетом ограничения частоты запросов.
+
+        Возвращает пары (employer_id, данные или None) в порядке идентификаторов.
+        """
+        def fetch(employer_id):
+            return employer_id, self.get_employer(employer_id)
+
+        yield from self._map(fetch, employer_ids, concurrent)
+
+    @staticmethod
+    def is_accepted(vacancy):
+        """Проверяет, что у вакансии нет зарплаты или зарплата указана в рублях"""
+        # Проверяем, есть ли у вакансии зарплата и валюта
+        if vacancy.get('salary') is not None and vacancy.get('salary').get('currency') is not None:
+            # Вакансии с зарплатой в другой валюте пропускаем
+            return vacancy.get('salary').get('currency') == "RUR"
+        # Вакансии без зарплаты или валюты принимаем
+        return True
+
+    def iter_vacancies(self, concurrent=True, ndjson_path=None):
+        """Возвращает вакансии из выдачи по одной, не накапливая их в памяти.
+
+        Если задан ndjson_path, вакансии в формате API дописываются в файл по одной JSON-строке, как их
+        выводит crawl: такой файл читают ingest --from-file, VacancyBatch.load_ndjson и hh_stub.
+        """
+        sink = open(ndjson_path, 'a', encoding="UTF-8") if ndjson_path else None
+        try:
+            for data in self.iter_pages(concurrent=concurrent):
+                for vacancy in data.get('items'):
+                    if sink is not None:
+                        sink.write(json.dumps(vacancy, ensure_ascii=False) + '\n')
+                    yield vacancy
+        finally:
+            if sink is not None:
+                sink.close()
+
+    @staticmethod
+    def get_info(data):
+        # Получаем идентификатор вакансии из данных и преобразуем его в целое число
+        vacancy_id = int(data.get('id'))
+        # Получаем название вакансии из данных
+        name = data['name']
+        # Получаем идентификатор работодателя из данных и преобразуем его в целое число
+        employer_id = int(data.get('employer').get('id'))
+        # Получаем название города из данных
+        city = data.get('area').get('name')
+        # Получаем URL вакансии из данных
+        url = data.get('alternate_url')
+
+        # Инициализируем зарплату как None
+        salary = None
+        # Проверяем, есть ли у вакансии зарплата и валюта
+        if data.get('salary') and data.get('salary').get('currency') == "RUR":
+            # Если валюта рубли, то получаем нижнюю границу зарплаты из данных
+            salary = data.get('salary').get('from')
+
+        # Создаем кортеж с данными о вакансии
+        vacancy = (vacancy_id, name, employer_id, city, salary, url)
+        # Возвращаем кортеж
+        return vacancy
+
+    def get_vacancies(self, concurrent=True, ndjson_path=None):
+        """Возвращает список вакансий в виде кортежей get_info (вакансии с зарплатой не в рублях пропускаются)"""
+        # Создаем пустой список для хранения вакансий
+        vacancies = []
+        # Получаем вакансии (страницы запрашиваются параллельно, если concurrent=True) в порядке номеров страниц
+        for vacancy in self.iter_vacancies(concurrent=concurrent, ndjson_path=ndjson_path):
+            if self.is_accepted(vacancy):
+                # Добавляем данные о вакансии в список с помощью метода get_info
                 vacancies.append(self.get_info(vacancy))
+        # Возвращаем список вакансий
+        return vacancies
 
-        # Увеличиваем номер страницы на 1
-        page += 1
-        # Делаем паузу в 0.2 секунды, чтобы не перегрузить сервер
-        time.sleep(0.2)
-
-        # Проверяем, достигли ли мы последней страницы результатов
-        if data.get('pages') == page:
-            # Если да, то прерываем цикл
-            break
-    # Сохраняем список вакансий в файле JSON с красивым форматированием и поддержкой кириллицы
-    with open('vacancies.json', 'w', encoding="UTF-8") as file:
-        json.dump(vacancies, file, indent=4, ensure_ascii=False)
-    # Преобразуем список вакансий в список кортежей (необязательно)
-    vacancy_lst = list(vacancies)
-    # Возвращаем список вакансий
-    return vacancies
 
 if __name__ == '__main__':
     search_keyword = 'Python'
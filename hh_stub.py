@@ -0,0 +1,145 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Значения, из которых собираются синтетические вакансии
+NAMES = ['Python разработчик', 'Senior Python Developer', 'Backend-разработчик (Python)', 'Data Engineer',
+         'Аналитик данных', 'Инженер по тестированию', 'DevOps-инженер', 'Team Lead Python']
+CITIES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань', 'Нижний Новгород']
+
+
+def make_item(index, rng, employers=2000):
+    """Создает синтетическую вакансию в формате ответа API"""
+    employer_id = rng.randrange(1, employers + 1)
+    salary = None
+    if rng.random() < 0.6:
+        salary_from = rng.randrange(50, 400) * 1000
+        salary = {'from': salary_from,
+                  'to': salary_from + rng.randrange(0, 200) * 1000 if rng.random() < 0.8 else None,
+                  'currency': 'RUR'}
+    city = rng.choice(CITIES)
+    return {'id': str(1000000 + index),
+            'name': rng.choice(NAMES),
+            'employer': {'id': str(employer_id), 'name': f'Компания {employer_id}'},
+            'area': {'name': city},
+            'address': {'city': city} if rng.random() < 0.7 else None,
+            'salary': salary,
+            'published_at': '2026-01-01T12:00:00+0300',
+            'url': f'https://api.hh.ru/vacancies/{1000000 + index}',
+            'alternate_url': f'https://hh.ru/vacancy/{1000000 + index}'}
+
+
+def make_items(count, seed=0):
+    """Создает список из count синтетических вакансий; одинаковый seed дает одинаковые данные"""
+    rng = random.Random(seed)
+    return [make_item(index, rng) for index in range(count)]
+
+
+def load_items(path):
+    """Загружает вакансии в формате API из NDJSON-файла (строки других форматов пропускаются)"""
+    items = []
+    with open(path, encoding='UTF-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and 'id' in record and 'employer' in record:
+                items.append(record)
+    return items
+
+
+class HHStub:
+    """Локальный HTTP-заменитель api.hh.ru для /vacancies и /employers/{id}.
+
+    Поддерживает задержку ответа, долю ответов 429 и ограничение API в 2000 результатов.
+    """
+
+    def __init__(self, items, latency=0.0, error_rate=0.0, max_results=2000, seed=0):
+        self.items = items
+        # Задержка каждого ответа в секундах
+        self.latency = latency
+        # Доля запросов, на которые отвечаем 429 Too Many Requests
+        self.error_rate = error_rate
+        self.max_results = max_results
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # Счетчики обработанных запросов по кодам ответа
+        self.responses = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self)
+
+        return Handler
+
+    def _reply(self, request, status, body=None):
+        with self.lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+        payload = json.dumps(body, ensure_ascii=False).encode('UTF-8') if body is not None else b''
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            request.send_header('Retry-After', '0')
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            throttled = self.rng.random() < self.error_rate
+        if throttled:
+            return self._reply(request, 429)
+        parsed = urlparse(request.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        employer = re.fullmatch(r'/employers/(\d+)', parsed.path)
+        if employer:
+            employer_id = employer.group(1)
+            return self._reply(request, 200, {'id': employer_id, 'name': f'Компания {employer_id}',
+                                              'type': 'company', 'trusted': True,
+                                              'area': {'name': 'Москва'}, 'industries': [],
+                                              'open_vacancies': 1})
+        if parsed.path != '/vacancies':
+            return self._reply(request, 404, {'errors': [{'type': 'not_found'}]})
+        per_page = max(1, int(query.get('per_page', 20)))
+        page = int(query.get('page', 0))
+        reachable = min(len(self.items), self.max_results)
+        start = page * per_page
+        self._reply(request, 200, {'items': self.items[start:min(start + per_page, reachable)],
+                                   'found': len(self.items),
+                                   'pages': -(-reachable // per_page),
+                                   'page': page,
+                                   'per_page': per_page})
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ReplayMiss(Exception):
+    """Запрос не найден в кэше в режиме воспроизведения без сети"""
+
+
+class ResponseCache:
+    """Дисковый кэш ответов API с TTL, LRU-вытеснением по размеру и поддержкой ETag / Last-Modified"""
+
+    def __init__(self, directory='.hh_cache', ttl=3600, max_bytes=256 * 1024 * 1024):
+        # Каталог, в котором каждый ответ хранится отдельным JSON-файлом
+        self.directory = directory
+        # Время жизни записи в секундах, после него запись нужно перепроверить у сервера
+        self.ttl = ttl
+        # Максимальный суммарный размер кэша, при превышении удаляются давно не использованные записи
+        self.max_bytes = max_bytes
+        # Текущий размер кэша в байтах; считается обходом каталога при первой записи, дальше - по записям
+        self.total_bytes = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Блокировку нельзя передать в другой процесс, там создается новая
+        state = self.__dict__.copy()
+        del state['lock']
+        # Другой процесс пересчитает размер сам: к этому времени каталог мог измениться
+        state['total_bytes'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize_params(params):
+        """Приводит параметры запроса к стабильному виду: строковые значения, без None, по алфавиту"""
+        return sorted((str(key), str(value)) for key, value in (params or {}).items() if value is not None)
+
+    def key(self, url, params):
+        """Возвращает ключ записи по URL и нормализованным параметрам"""
+        raw = json.dumps([url, self.normalize_params(params)], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('UTF-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, url, params):
+        """Возвращает запись кэша или None; обращение обновляет время использования записи для LRU"""
+        path = self._path(self.key(url, params))
+        try:
+            with open(path, encoding='UTF-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        # Время изменения файла служит отметкой последнего использования. Другой поток мог уже
+        # вытеснить файл; запись прочитана, поэтому просто пропускаем отметку
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def is_fresh(self, entry):
+        """Проверяет, что запись еще не старше TTL"""
+        return time.time() - entry['stored_at'] < self.ttl
+
+    def put(self, url, params, body, headers=None):
+        """Сохраняет тело ответа и валидаторы (ETag, Last-Modified) и при необходимости вытесняет старые записи"""
+        headers = headers or {}
+        entry = {'url': url,
+                 'params': self.normalize_params(params),
+                 'body': body,
+                 'etag': headers.get('ETag'),
+                 'last_modified': headers.get('Last-Modified'),
+                 'stored_at': time.time()}
+        path = self._path(self.key(url, params))
+        # Пишем во временный файл и переименовываем, чтобы параллельные читатели не увидели половину записи
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='UTF-8') as file:
+            json.dump(entry, file, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, size, _ in self._scan())
+            # Перезаписанный файл больше не занимает место
+            try:
+                size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        return entry
+
+    def touch(self, url, params, entry):
+        """Продлевает запись после ответа 304 Not Modified"""
+        return self.put(url, params, entry['body'], {'ETag': entry.get('etag'),
+                                                     'Last-Modified': entry.get('last_modified')})
+
+    def _scan(self):
+        """Возвращает (время использования, размер, путь) для каждой записи в каталоге кэша"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _evict(self):
+        """Удаляет давно не использованные записи (вызывается под self.lock, когда кэш больше max_bytes).
+
+        Каталог обходится только здесь. Место освобождается с запасом до 90% max_bytes,
+        чтобы следующие записи не вызывали обход снова.
+        """
+        files = self._scan()
+        # Пересчитываем размер заново: в тот же каталог могут писать другие процессы
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        # Сначала удаляем записи, к которым дольше всего не обращались
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+        self.total_bytes = total
+
+    def export_ndjson(self, path):
+        """Выгружает все записи кэша в NDJSON-файл (одна запись на строку) для воспроизведения на другой машине"""
+        with open(path, 'w', encoding='UTF-8') as out:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    with open(entry.path, encoding='UTF-8') as file:
+                        out.write(json.dumps(json.load(file), ensure_ascii=False) + '\n')
+
+    def load_ndjson(self, path):
+        """Загружает записанные ответы из NDJSON-файла в кэш; строки без url и body пропускаются"""
+        loaded = 0
+        with open(path, encoding='UTF-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if 'url' not in record or 'body' not in record:
+                    continue
+                self.put(record['url'], dict(record.get('params') or {}), record['body'],
+                         {'ETag': record.get('etag'), 'Last-Modified': record.get('last_modified')})
+                loaded += 1
+        return loaded
@@ -1,55 +1,360 @@
-# импортируем модуль для работы с базой данных
-from db_manager import DBManager
+# импортируем модули стандартной библиотеки для разбора аргументов и вывода результатов
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import date
+from decimal import Decimal
+
 # импортируем модуль с настройками
 from config import config
-# импортируем модуль для парсинга сайта hh.ru
-from hh_parser import HeadHunter
+# импортируем общий набор метрик, в который стадии подкоманд записывают свои интервалы
+from metrics import METRICS
 
-# задаем пути к файлам с данными
-PATH = 'vacancies.json'
-PATH_2 = 'employers.json'
+# Остальные модули проекта импортируются внутри подкоманд: отчетам и поиску не нужны
+# requests и клиент API, а загрузке не нужен вывод отчетов
+
+# задаем имя базы данных по умолчанию
+DBNAME = 'head_hunter'
+# задаем ключевые слова для поиска вакансий
+SEARCH_KEYWORDS = ['Python']
+
+# Отчеты подкоманды report: имя -> (названия столбцов, функция от DBManager и аргументов командной строки).
+# Большие отчеты читаются потоково через серверный курсор
+REPORTS = {
+    'companies_and_vacancies_count': (('employer_name', 'quantity_vacancies'),
+                                      lambda db, args: db.iter_companies_and_vacancies_count()),
+    'all_vacancies': (('employer_name', 'vacancy_name', 'salary_max', 'url'),
+                      lambda db, args: db.iter_all_vacancies()),
+    'avg_salary': (('average_salary',),
+                   lambda db, args: db.get_avg_salary()),
+    'vacancies_with_higher_salary': (('vacancy_name', 'salary_max'),
+                                     lambda db, args: db.get_vacancies_with_higher_salary()),
+    'salary_stats': (('city', 'vacancies_with_salary', 'avg_salary', 'p25', 'median', 'p75', 'p90'),
+                     lambda db, args: db.get_salary_stats(by_city=True)),
+    'salary_trend': (('week', 'vacancies', 'vacancies_with_salary', 'avg_salary', 'p25', 'median', 'p75', 'p90'),
+                     lambda db, args: db.get_salary_trend(args.keyword, args.date_from, args.date_to)),
+    'employer_salary_trend': (('employer_id', 'employer_name', 'week', 'vacancies', 'avg_salary', 'median', 'p90'),
+                              lambda db, args: db.get_employer_salary_trend(args.employer, args.keyword,
+                                                                            args.date_from, args.date_to)),
+}
+# Отчеты по истории vacancy_snapshots, которые принимают фильтры --keyword, --employer, --from и --to
+TREND_REPORTS = ('salary_trend', 'employer_salary_trend')
+
+
+def _json_default(value):
+    # Decimal из PostgreSQL выводим числом, остальные нестандартные типы - строкой
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def write_rows(columns, rows, output_format, out=sys.stdout):
+    """Построчно выводит результат в CSV (с заголовком) или NDJSON, не накапливая его в памяти"""
+    if output_format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+    else:
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + '\n')
+
+
+def get_db(args, **options):
+    """Создает DBManager по параметрам командной строки"""
+    from db_manager import DBManager
+
+    return DBManager(args.dbname, config(args.config), **options)
+
+
+def get_hh_options(args):
+    """Возвращает параметры HeadHunter для кэша ответов по флагам --cache-dir и --replay"""
+    if not args.cache_dir and not args.replay:
+        return {}
+    from http_cache import ResponseCache
+
+    cache = ResponseCache(args.cache_dir) if args.cache_dir else ResponseCache()
+    if not args.replay:
+        return {'cache': cache}
+    # Записанные ответы загружаем в кэш и отвечаем только из него, без обращений к API
+    cache.load_ndjson(args.replay)
+    return {'cache': cache, 'replay_only': True}
+
+
+def cmd_crawl(args):
+    """Загружает вакансии из API и выводит их в формате API построчно (NDJSON), без записи в БД"""
+    if args.sharded:
+        from shard_crawler import iter_sharded_vacancies
+
+        items = iter_sharded_vacancies(args.keywords, processes=args.processes, ndjson_path=args.ndjson,
+                                       **get_hh_options(args))
+    else:
+        from pipeline import iter_keyword_vacancies
+
+        items = iter_keyword_vacancies(args.keywords, ndjson_path=args.ndjson, **get_hh_options(args))
+    with METRICS.span('crawl'):
+        for item in items:
+            sys.stdout.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+
+def _read_items(path):
+    """Читает вакансии в формате API из NDJSON-файла или из stdin, если path равен '-'"""
+    file = sys.stdin if path == '-' else open(path, encoding='UTF-8')
+    try:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def record_history(db, args):
+    """Дописывает снимок вакансий в историю и удаляет устаревшие секции, если это запрошено флагами"""
+    stats = {}
+    if args.history:
+        with METRICS.span('record_snapshot'):
+            stats['snapshot'] = db.record_snapshot()
+    if args.keep_days is not None:
+        with METRICS.span('snapshot_retention'):
+            stats['dropped_partitions'] = db.apply_snapshot_retention(args.keep_days)
+    return stats
+
+
+def cmd_ingest(args):
+    """Загружает вакансии в БД: из API по ключевым словам или из NDJSON-файла, выданного crawl"""
+    db = get_db(args)
+    hh_options = get_hh_options(args)
+    try:
+        if args.rebuild:
+            # Полное пересоздание базы данных, как в прежнем режиме запуска
+            with METRICS.span('create_database'):
+                db.create_database()
+        else:
+            with METRICS.span('ensure_schema'):
+                db.ensure_schema()
+        if args.from_file:
+            from pipeline import iter_batches
+
+            rows = 0
+            with METRICS.span('ingest_file'):
+                for batch in iter_batches(_read_items(args.from_file), args.batch_size):
+                    rows += db.insert_data_into_db({'items': batch}, batch_size=args.batch_size,
+                                                   refresh=False)['rows']
+            with METRICS.span('refresh_aggregates'):
+                db.refresh_aggregates()
+            stats = {'rows': rows}
+        elif args.sharded:
+            from shard_crawler import ingest_sharded
+
+            with METRICS.span('crawl_and_ingest'):
+                stats = ingest_sharded(db, args.keywords, batch_size=args.batch_size, processes=args.processes,
+                                       ndjson_path=args.ndjson, **hh_options)
+        else:
+            from pipeline import crawl_to_db
+
+            with METRICS.span('crawl_and_ingest'):
+                stats = crawl_to_db(db, args.keywords, batch_size=args.batch_size, ndjson_path=args.ndjson,
+                                    **hh_options)
+        if args.enrich_employers:
+            from hh_parser import HeadHunter
+
+            with METRICS.span('enrich_employers'):
+                stats['employers'] = db.enrich_employers(hh=HeadHunter(**hh_options))
+        stats.update(record_history(db, args))
+    finally:
+        db.close()
+    print(json.dumps(stats, ensure_ascii=False, default=_json_default), file=sys.stderr)
+
+
+def cmd_sync(args):
+    """Инкрементально синхронизирует вакансии по ключевым словам с существующей БД"""
+    db = get_db(args)
+    hh_options = get_hh_options(args)
+    try:
+        with METRICS.span('ensure_schema'):
+            db.ensure_schema()
+        for search_keyword in args.keywords:
+            with METRICS.span('sync'):
+                stats = db.sync(search_keyword, full=args.full, batch_size=args.batch_size, **hh_options)
+            print(json.dumps(dict(stats, search_keyword=search_keyword), ensure_ascii=False), file=sys.stderr)
+        history = record_history(db, args)
+        if history:
+            print(json.dumps(history, ensure_ascii=False), file=sys.stderr)
+    finally:
+        db.close()
+
+
+def cmd_report(args):
+    """Выводит один отчет из существующей БД"""
+    columns, report = REPORTS[args.name]
+    if args.name not in TREND_REPORTS and (args.keyword or args.employer is not None or args.date_from
+                                           or args.date_to):
+        sys.exit(f"--keyword, --employer, --from и --to поддерживают только отчеты {', '.join(TREND_REPORTS)}")
+    db = get_db(args, maxconn=1)
+    try:
+        with METRICS.span('report'):
+            write_rows(columns, report(db, args), args.format)
+    finally:
+        db.close()
+
+
+def cmd_search(args):
+    """Ищет вакансии по словам в существующей БД и выводит страницу результатов"""
+    db = get_db(args, maxconn=1)
+    try:
+        with METRICS.span('search'):
+            rows = db.search_vacancies(' '.join(args.words), limit=args.limit, page=args.page)
+        write_rows(('vacancy_id', 'vacancy_name', 'salary_max', 'url', 'rank'), rows, args.format)
+    finally:
+        db.close()
+
+
+def run(args):
+    """Прежний режим запуска: пересоздает БД, загружает вакансии и печатает все отчеты"""
+    from db_manager import DBManager
+    from shard_crawler import ingest_sharded
 
-# определяем основную функцию
-def main():
     # получаем параметры для подключения к базе данных
-    params = config()
+    params = config(args.config)
     # создаем объект класса DBManager с именем базы данных и параметрами
-    db = DBManager('head_hunter', params)
+    db = DBManager(args.dbname, params)
     print('Создаем БД и таблицы')
     # вызываем метод create_database для создания базы данных и таблиц
-    db2 = db.create_database()
+    with METRICS.span('create_database'):
+        db.create_database()
     print(f'БД и таблицы созданы')
-    # задаем ключевое слово для поиска вакансий
-    search_keyword = 'Python'
-    # создаем объект класса HeadHunter с ключевым словом
-    hh = HeadHunter(search_keyword)
-    # вызываем метод get_request для получения данных с сайта hh.ru
-    k = hh.get_request()
-    print('Добавляем данные из запроса в БД')
-    # вызываем метод insert_data_into_db для добавления данных в базу данных
-    db.insert_data_into_db(k)
+    print('Загружаем вакансии по ключевым словам в БД')
+    # загружаем все вакансии по ключевым словам срезами, чтобы обойти ограничение API в 2000 результатов
+    with METRICS.span('crawl_and_ingest'):
+        stats = ingest_sharded(db, SEARCH_KEYWORDS, **get_hh_options(args))
+    print(f"Загружено строк: {stats['rows']} за {stats['seconds']} с ({stats['rows_per_second']} строк/с)")
+    # вызываем метод run_reports, чтобы получить все отчеты на одном соединении и в одном снимке данных
+    with METRICS.span('reports'):
+        reports = db.run_reports(SEARCH_KEYWORDS[0].lower())
     print("""Получаем список компаний и количество вакансий""")
-    # вызываем метод get_companies_and_vacancies_count для получения списка компаний и количества вакансий у каждой из них
-    data = db.get_companies_and_vacancies_count()
-    print(data)
+    print(reports['companies_and_vacancies_count'])
     print("""Получаем список всех вакансий""")
-    # вызываем метод get_all_vacancies для получения списка всех вакансий
-    data_2 = db.get_all_vacancies()
-    print(data_2)
+    print(reports['all_vacancies'])
     print("""Получает среднюю зарплату по вакансиям""")
-    # вызываем метод get_avg_salary для получения средней зарплаты по вакансиям
-    data_3 = db.get_avg_salary()
-    print(data_3)
-    print("""Получаем список всех компаний и количество вакансий у каждой компании""")
-    # вызываем метод get_vacancies_with_higher_salary для получения списка вакансий с зарплатой выше средней
-    data_4 = db.get_vacancies_with_higher_salary()
-    print(data_4)
-    print("""Получаем список всех компаний и количество вакансий у каждой компании""")
-    # вызываем метод get_vacancies_with_keyword для получения списка вакансий, содержащих определенное ключевое слово
-    data_5 = db.get_vacancies_with_keyword('python')
-    print(data_5)
+    print(reports['avg_salary'])
+    print("""Получаем список вакансий с зарплатой выше средней""")
+    print(reports['vacancies_with_higher_salary'])
+    print("""Получаем список вакансий, содержащих ключевое слово""")
+    print(reports['vacancies_with_keyword'])
+    # закрываем соединения пула
+    db.close()
+
+
+def add_history_arguments(parser):
+    """Добавляет подкоманде флаги записи истории вакансий"""
+    parser.add_argument('--history', action='store_true',
+                        help='дописать снимок вакансий в историю vacancy_snapshots для отчетов по неделям')
+    parser.add_argument('--keep-days', type=int, metavar='DAYS',
+                        help='удалить секции истории старше DAYS дней')
+
+
+def build_parser():
+    """Создает разбор аргументов командной строки с подкомандами"""
+    parser = argparse.ArgumentParser(description='Загрузка вакансий hh.ru в PostgreSQL и отчеты по ним')
+    parser.add_argument('--config', default='database.ini', help='файл с параметрами подключения к PostgreSQL')
+    parser.add_argument('--dbname', default=DBNAME, help='имя базы данных')
+    parser.add_argument('--metrics', action='store_true',
+                        help='сохранить метрики в metrics.prom и отчет о запуске в run_report.json')
+    parser.add_argument('--profile', metavar='PATH', help='профилировать запуск через cProfile и сохранить в PATH')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='кэшировать ответы API на диске в DIR (по умолчанию .hh_cache при --replay)')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='отвечать на запросы к API только записанными ответами из NDJSON-файла, без сети')
+    commands = parser.add_subparsers(dest='command')
+
+    crawl = commands.add_parser('crawl', help='загрузить вакансии из API и вывести их в NDJSON')
+    crawl.add_argument('keywords', nargs='+')
+    crawl.add_argument('--sharded', action='store_true', help='делить поиск на срезы в пуле процессов')
+    crawl.add_argument('--processes', type=int, default=4)
+    crawl.add_argument('--ndjson', help='дописывать вакансии в формате API в этот файл')
+    crawl.set_defaults(handler=cmd_crawl)
+
+    ingest = commands.add_parser('ingest', help='загрузить вакансии в БД')
+    ingest.add_argument('keywords', nargs='*', default=SEARCH_KEYWORDS)
+    ingest.add_argument('--from-file', metavar='PATH', help="NDJSON из crawl вместо запросов к API ('-' - stdin)")
+    ingest.add_argument('--sharded', action='store_true', help='делить поиск на срезы в пуле процессов')
+    ingest.add_argument('--processes', type=int, default=4)
+    ingest.add_argument('--batch-size', type=int, default=1000)
+    ingest.add_argument('--ndjson', help='дописывать вакансии в формате API в этот файл')
+    ingest.add_argument('--rebuild', action='store_true', help='пересоздать базу данных перед загрузкой')
+    ingest.add_argument('--enrich-employers', action='store_true', help='дозапросить данные работодателей')
+    add_history_arguments(ingest)
+    ingest.set_defaults(handler=cmd_ingest)
+
+    sync = commands.add_parser('sync', help='инкрементально синхронизировать вакансии')
+    sync.add_argument('keywords', nargs='*', default=SEARCH_KEYWORDS)
+    sync.add_argument('--full', action='store_true', help='полная выгрузка с архивированием пропавших вакансий')
+    sync.add_argument('--batch-size', type=int, default=1000)
+    add_history_arguments(sync)
+    sync.set_defaults(handler=cmd_sync)
+
+    report = commands.add_parser('report', help='вывести отчет из существующей БД')
+    report.add_argument('name', choices=sorted(REPORTS))
+    report.add_argument('--format', choices=('csv', 'json'), default='csv')
+    report.add_argument('--keyword', help=f"только вакансии, найденные по ключевому слову ({', '.join(TREND_REPORTS)})")
+    report.add_argument('--employer', type=int, metavar='EMPLOYER_ID',
+                        help='только один работодатель (employer_salary_trend)')
+    report.add_argument('--from', dest='date_from', type=date.fromisoformat, metavar='YYYY-MM-DD',
+                        help='начало периода включительно, по умолчанию 13 недель назад (отчеты по истории)')
+    report.add_argument('--to', dest='date_to', type=date.fromisoformat, metavar='YYYY-MM-DD',
+                        help='конец периода не включительно, по умолчанию завтра (отчеты по истории)')
+    report.set_defaults(handler=cmd_report)
+
+    search = commands.add_parser('search', help='найти вакансии в существующей БД')
+    search.add_argument('words', nargs='+')
+    search.add_argument('--limit', type=int, default=20)
+    search.add_argument('--page', type=int, default=0)
+    search.add_argument('--format', choices=('csv', 'json'), default='csv')
+    search.set_defaults(handler=cmd_search)
+    return parser
+
+
+# определяем основную функцию
+def main(argv=None):
+    parser = build_parser()
+    args, unknown = parser.parse_known_args(argv)
+    # Исключаемые слова поиска (-senior) argparse принимает за неизвестные флаги, возвращаем их в запрос
+    if unknown:
+        if getattr(args, 'command', None) != 'search' or any(arg.startswith('--') for arg in unknown):
+            parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+        args.words += unknown
+    # без подкоманды работаем как раньше: пересоздаем БД, загружаем вакансии и печатаем отчеты
+    handler = getattr(args, 'handler', None)
+    command = (lambda: (handler or run)(args))
+    # метрики нужны прежнему режиму запуска всегда, а подкомандам - по флагу --metrics
+    collect_metrics = args.metrics or handler is None
+    # сбрасываем метрики, чтобы отчет о запуске содержал только этот запуск
+    METRICS.reset()
+    try:
+        if args.profile:
+            from metrics import profile
+
+            # профилируем весь запуск через cProfile и сохраняем статистику в файл
+            with profile(args.profile):
+                command()
+        else:
+            command()
+    except BrokenPipeError:
+        # вывод закрыт раньше времени (например, | head): перенаправляем stdout в /dev/null,
+        # чтобы интерпретатор не упал при сбросе буфера на выходе
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if collect_metrics:
+            # сохраняем метрики в формате Prometheus и JSON-отчет о запуске, даже если запуск упал
+            METRICS.write_prometheus('metrics.prom')
+            METRICS.write_json('run_report.json')
+
 
 # проверяем, что модуль запускается как главный файл, а не импортируется
 if __name__ == '__main__':
     # вызываем основную функцию
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+class Metrics:
+    """Счетчики, гистограммы и интервалы стадий конвейера с выгрузкой в Prometheus и JSON (потокобезопасно)"""
+
+    # Границы корзин гистограмм времени в секундах
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, prefix='hh'):
+        # Префикс имен метрик в формате Prometheus
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает все накопленные значения"""
+        with self.lock:
+            # (имя, метки) -> значение
+            self.counters = {}
+            # (имя, метки) -> {'buckets': [...], 'sum': ..., 'count': ...}
+            self.histograms = {}
+            # Завершенные стадии конвейера в порядке завершения
+            self.spans = []
+            self.started_at = datetime.now(timezone.utc)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Увеличивает счетчик"""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Добавляет значение в гистограмму"""
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Измеряет время выполнения блока и добавляет его в гистограмму name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def span(self, stage):
+        """Измеряет стадию конвейера (загрузка, запись, отчеты) и запоминает ее для отчета о запуске"""
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe('stage_seconds', seconds, stage=stage)
+            with self.lock:
+                self.spans.append({'stage': stage,
+                                   'started_at': started_at.isoformat(timespec='milliseconds'),
+                                   'seconds': round(seconds, 6),
+                                   'error': error})
+
+    def snapshot(self):
+        """Возвращает копию счетчиков и гистограмм для передачи из дочернего процесса"""
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {key: {'buckets': list(histogram['buckets']), 'sum': histogram['sum'],
+                                         'count': histogram['count']}
+                                   for key, histogram in self.histograms.items()}}
+
+    def merge(self, snapshot):
+        """Добавляет значения, полученные методом snapshot в другом процессе"""
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in snapshot['histograms'].items():
+                histogram = self.histograms.setdefault(key, {'buckets': [0] * len(self.BUCKETS),
+                                                             'sum': 0.0, 'count': 0})
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+
+    def to_dict(self):
+        """Возвращает все метрики в виде словаря для JSON-отчета о запуске"""
+        with self.lock:
+            return {'started_at': self.started_at.isoformat(timespec='seconds'),
+                    'spans': list(self.spans),
+                    'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                                 for (name, labels), value in sorted(self.counters.items())],
+                    'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram['count'],
+                                    'sum': round(histogram['sum'], 6),
+                                    'buckets': dict(zip(map(str, self.BUCKETS), histogram['buckets']))}
+                                   for (name, labels), histogram in sorted(self.histograms.items())]}
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def to_prometheus(self):
+        """Возвращает метрики в текстовом формате Prometheus"""
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f'{self.prefix}_{name}'
+                if metric not in typed:
+                    lines.append(f'# TYPE {metric} counter')
+                    typed.add(metric)
+                lines.append(f'{metric}{self._labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f'{self.prefix}_{name}'
+                if metric not in typed:
+                    lines.append(f'# TYPE {metric} histogram')
+                    typed.add(metric)
+                # Корзины в Prometheus накопительные, поэтому значения уже посчитаны с учетом меньших границ
+                for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                    lines.append(f'{metric}_bucket{self._labels(labels, [("le", str(bound))])} {count}')
+                lines.append(f'{metric}_bucket{self._labels(labels, [("le", "+Inf")])} {histogram["count"]}')
+                lines.append(f'{metric}_sum{self._labels(labels)} {histogram["sum"]}')
+                lines.append(f'{metric}_count{self._labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write(path, text):
+        # Пишем во временный файл и переименовываем, чтобы node_exporter не прочитал половину файла
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='UTF-8') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+    def write_prometheus(self, path):
+        """Сохраняет метрики в файл для textfile-коллектора node_exporter"""
+        self._write(path, self.to_prometheus())
+
+    def write_json(self, path):
+        """Сохраняет JSON-отчет о запуске"""
+        self._write(path, json.dumps(self.to_dict(), indent=2, ensure_ascii=False))
+
+
+# Общий набор метрик процесса, в который пишут HeadHunter, DBManager и main.py
+METRICS = Metrics()
+
+
+def load_stats(rows, started) -> dict:
+    """Возвращает статистику загрузки: строки, секунды с момента started (по time.perf_counter) и строки в секунду"""
+    seconds = time.perf_counter() - started
+    return {'rows': rows,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds) if seconds else rows}
+
+
+@contextmanager
+def profile(path=None, top=30):
+    """Профилирует блок через cProfile.
+
+    Если задан path, статистика сохраняется в файл для snakeviz/pstats, иначе самые
+    затратные по суммарному времени функции печатаются на экран.
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        else:
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+
+from hh_parser import HeadHunter
+from metrics import load_stats
+
+# Признак окончания потока пакетов в очереди
+_DONE = object()
+
+
+def iter_batches(items, batch_size):
+    """Группирует поток элементов в списки фиксированного размера"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    # Отдаем последний неполный пакет
+    if batch:
+        yield batch
+
+
+def iter_tagged_vacancies(keywords, concurrent=True, ndjson_path=None, **hh_options):
+    """Последовательно обходит выдачу по каждому ключевому слову и возвращает пары (ключевое слово, вакансия)"""
+    for search_keyword in keywords:
+        hh = HeadHunter(search_keyword, **hh_options)
+        for item in hh.iter_vacancies(concurrent=concurrent, ndjson_path=ndjson_path):
+            yield search_keyword, item
+
+
+def iter_keyword_vacancies(keywords, concurrent=True, ndjson_path=None, **hh_options):
+    """Последовательно обходит выдачу по каждому ключевому слову и возвращает вакансии по одной"""
+    for _, item in iter_tagged_vacancies(keywords, concurrent=concurrent, ndjson_path=ndjson_path, **hh_options):
+        yield item
+
+
+def load_tagged_batches(db, batches, batch_size) -> dict:
+    """Записывает пакеты пар (ключевое слово, вакансия) в базу данных.
+
+    Вместе с вакансиями записываются ключевые слова, по которым они найдены, а агрегаты для отчетов
+    пересчитываются один раз после всех пакетов. Возвращает статистику загрузки.
+    """
+    started = time.perf_counter()
+    rows = 0
+    for batch in batches:
+        keywords = [(search_keyword, item['id']) for search_keyword, item in batch]
+        rows += db.insert_data_into_db({'items': [item for _, item in batch]}, batch_size=batch_size,
+                                       refresh=False, keywords=keywords)['rows']
+    db.refresh_aggregates()
+    return load_stats(rows, started)
+
+
+def crawl_to_db(db, keywords, batch_size=500, queue_size=4, ndjson_path=None, **hh_options) -> dict:
+    """Потоково загружает вакансии по списку ключевых слов в базу данных.
+
+    Страницы запрашиваются в отдельном потоке и пакетами по batch_size вакансий передаются
+    через очередь размером queue_size в DBManager.insert_data_into_db. Загрузка и запросы к API
+    идут одновременно, а в памяти одновременно находится не больше queue_size + 2 пакетов.
+    """
+    batches = queue.Queue(maxsize=queue_size)
+    # Флаг остановки производителя, если потребитель завершился с ошибкой
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for batch in iter_batches(iter_tagged_vacancies(keywords, ndjson_path=ndjson_path, **hh_options),
+                                      batch_size):
+                # Блокируемся, пока в очереди нет места, периодически проверяя флаг остановки
+                while not stop.is_set():
+                    try:
+                        batches.put(batch, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as error:
+            # Ошибку запроса передаем в основной поток
+            errors.append(error)
+        finally:
+            batches.put(_DONE)
+
+    def consume():
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                break
+            yield batch
+        # Ошибку запроса пробрасываем до пересчета агрегатов
+        if errors:
+            raise errors[0]
+
+    producer = threading.Thread(target=produce, name='hh-crawler', daemon=True)
+    producer.start()
+    try:
+        return load_tagged_batches(db, consume(), batch_size)
+    finally:
+        stop.set()
+        # Освобождаем место в очереди, чтобы производитель мог положить признак окончания
+        while producer.is_alive():
+            try:
+                batches.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        producer.join()
@@ -45,4 +45,84 @@ ORDER BY salary_max DESC, vacancy_name
 SELECT vacancy_name
 FROM vacancies
 WHERE vacancy_name ILIKE '%python%'
-ORDER BY vacancy_name
\ No newline at end of file
+ORDER BY vacancy_name
+
+--search_index
+ALTER TABLE vacancies
+ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+	setweight(to_tsvector('russian', vacancy_name), 'A') ||
+	setweight(to_tsvector('english', vacancy_name), 'B')) STORED;
+CREATE INDEX IF NOT EXISTS vacancies_search_vector_idx ON vacancies USING gin (search_vector);
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS vacancies_name_trgm_idx ON vacancies USING gin (vacancy_name gin_trgm_ops);
+
+--search_vacancies
+WITH fulltext AS (
+	SELECT vacancy_id, vacancy_name, salary_max, url,
+		GREATEST(ts_rank(search_vector, websearch_to_tsquery('russian', 'python developer')),
+		         ts_rank(search_vector, websearch_to_tsquery('english', 'python developer'))) AS rank
+	FROM vacancies
+	WHERE NOT archived
+	AND (search_vector @@ websearch_to_tsquery('russian', 'python developer')
+	     OR search_vector @@ websearch_to_tsquery('english', 'python developer')))
+SELECT * FROM fulltext
+UNION ALL
+SELECT vacancy_id, vacancy_name, salary_max, url, word_similarity('python developer', vacancy_name)
+FROM vacancies
+WHERE NOT EXISTS (SELECT 1 FROM fulltext)
+AND NOT archived AND 'python developer' <% vacancy_name
+ORDER BY rank DESC, vacancy_id
+LIMIT 20 OFFSET 0
+
+--vacancy_snapshots
+CREATE TABLE IF NOT EXISTS vacancy_snapshots
+(
+	crawled_on date NOT NULL,
+	vacancy_id int NOT NULL,
+	employer_id int NOT NULL,
+	vacancy_name varchar(255) NOT NULL,
+	city text,
+	salary_min int,
+	salary_max int,
+	published_at timestamptz,
+	search_keywords text[] NOT NULL DEFAULT '{}',
+	PRIMARY KEY (crawled_on, vacancy_id)
+) PARTITION BY RANGE (crawled_on);
+CREATE INDEX IF NOT EXISTS vacancy_snapshots_crawled_on_idx ON vacancy_snapshots USING brin (crawled_on);
+CREATE INDEX IF NOT EXISTS vacancy_snapshots_employer_idx ON vacancy_snapshots (employer_id, crawled_on);
+CREATE TABLE IF NOT EXISTS vacancy_snapshots_2026_10 PARTITION OF vacancy_snapshots
+FOR VALUES FROM ('2026-10-01') TO ('2026-11-01');
+
+--snapshot_retention
+ALTER TABLE vacancy_snapshots DETACH PARTITION vacancy_snapshots_2025_09;
+DROP TABLE vacancy_snapshots_2025_09;
+
+--salary_trend
+SELECT week, COUNT(*) AS vacancies, COUNT(salary_max) AS vacancies_with_salary,
+	ROUND(AVG(salary_max)) AS avg_salary,
+	percentile_cont(0.25) WITHIN GROUP (ORDER BY salary_max) AS p25,
+	percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_max) AS median,
+	percentile_cont(0.75) WITHIN GROUP (ORDER BY salary_max) AS p75,
+	percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_max) AS p90
+FROM (SELECT DISTINCT ON (1, vacancy_id) date_trunc('week', crawled_on)::date AS week, salary_max
+      FROM vacancy_snapshots
+      WHERE crawled_on >= '2026-07-01' AND crawled_on < '2026-10-01'
+      AND 'Python' = ANY(search_keywords)
+      ORDER BY 1, vacancy_id, crawled_on DESC) AS weekly
+GROUP BY week
+ORDER BY week
+
+--employer_salary_trend
+SELECT employer_id, employer_name, week, COUNT(*) AS vacancies,
+	ROUND(AVG(salary_max)) AS avg_salary,
+	percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_max) AS median,
+	percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_max) AS p90
+FROM (SELECT DISTINCT ON (1, vacancy_id) date_trunc('week', crawled_on)::date AS week, vacancy_id, employer_id, salary_max
+      FROM vacancy_snapshots
+      WHERE crawled_on >= '2026-07-01' AND crawled_on < '2026-10-01'
+      AND employer_id = 1740
+      AND 'Python' = ANY(search_keywords)
+      ORDER BY 1, vacancy_id, crawled_on DESC) AS weekly
+LEFT JOIN employers USING(employer_id)
+GROUP BY employer_id, employer_name, week
+ORDER BY employer_name, employer_id, week
@@ -0,0 +1,143 @@
+import json
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+from hh_parser import HeadHunter
+from metrics import METRICS
+from pipeline import iter_batches, load_tagged_batches
+
+# Максимальное количество результатов, которое API отдает по одному запросу
+MAX_RESULTS = 2000
+
+
+def _count(hh, base_params, filters):
+    """Возвращает количество найденных вакансий для среза"""
+    # Одной вакансии на странице достаточно, чтобы узнать поле found
+    hh.params = dict(base_params, per_page=1, **filters)
+    return hh.get_page(0).get('found', 0)
+
+
+def _window(date_from, date_to):
+    """Возвращает фильтры API для окна даты публикации"""
+    return {'date_from': date_from.isoformat(timespec='seconds'),
+            'date_to': date_to.isoformat(timespec='seconds')}
+
+
+def plan_slices(search_keyword, date_from=None, date_to=None, areas=None, min_window=timedelta(minutes=10),
+                **hh_options):
+    """Разбивает поиск на срезы, каждый из которых помещается в ограничение API в 2000 результатов.
+
+    Поиск делится по регионам (areas) и окнам даты публикации. Окно, в котором найдено больше
+    MAX_RESULTS вакансий, рекурсивно делится пополам, пока не станет короче min_window.
+    Возвращает список словарей с фильтрами для HeadHunter.
+    """
+    # По умолчанию берем последние 30 дней: API ищет только по вакансиям, опубликованным за этот период
+    date_to = date_to or datetime.now(timezone.utc)
+    date_from = date_from or date_to - timedelta(days=30)
+    # Один клиент на все запросы подсчета, чтобы они шли через общий ограничитель частоты
+    hh = HeadHunter(search_keyword, **hh_options)
+    base_params = dict(hh.params)
+    slices = []
+    # Стек срезов, которые еще нужно проверить
+    stack = [dict(_window(date_from, date_to), **({'area': area} if area else {}), _range=(date_from, date_to))
+             for area in (areas or [None])]
+    while stack:
+        current = stack.pop()
+        start, end = current.pop('_range')
+        found = _count(hh, base_params, current)
+        if found == 0:
+            continue
+        if found <= MAX_RESULTS or end - start <= min_window:
+            if found > MAX_RESULTS:
+                # Дальше делить некуда, часть вакансий этого окна будет потеряна. Предупреждение идет
+                # в stderr, чтобы не испортить NDJSON, который crawl выводит в stdout
+                warnings.warn(f'Срез {current} содержит {found} вакансий, будут загружены первые {MAX_RESULTS}',
+                              RuntimeWarning)
+            slices.append(current)
+            continue
+        # Делим окно публикации пополам; границы окон пересекаются на одну секунду, дубли убираются позже
+        middle = start + (end - start) / 2
+        for left, right in ((start, middle), (middle, end)):
+            half = dict(current, **_window(left, right))
+            half['_range'] = (left, right)
+            stack.append(half)
+    return slices
+
+
+def crawl_slice(search_keyword, filters, hh_options):
+    """Загружает все вакансии одного среза (выполняется в отдельном процессе).
+
+    Возвращает вакансии и метрики запросов этого среза, которые основной процесс добавляет к своим.
+    """
+    # Процесс пула мог унаследовать метрики родителя или предыдущего среза, считаем с нуля
+    METRICS.reset()
+    hh = HeadHunter(search_keyword, filters=filters, **hh_options)
+    items = [item for page in hh.iter_pages() for item in page.get('items', [])]
+    return items, METRICS.snapshot()
+
+
+def iter_sharded_vacancies(keywords, processes=4, rate_limit=5.0, areas=None, ndjson_path=None, with_keywords=False,
+                           **hh_options):
+    """Загружает вакансии по списку ключевых слов срезами в пуле процессов.
+
+    Возвращает уникальные по vacancy_id вакансии по мере готовности срезов. Ограничение частоты
+    rate_limit задается на весь пул и делится между процессами поровну.
+    Если задан ndjson_path, вакансии в формате API дописываются в файл, как в HeadHunter.iter_vacancies.
+    При with_keywords=True возвращаются уникальные пары (ключевое слово, вакансия): вакансия,
+    найденная по нескольким ключевым словам, возвращается по разу для каждого из них.
+    """
+    # Сначала планируем срезы всех ключевых слов с полной частотой, а затем загружаем их в пуле.
+    # Если планировать во время загрузки, суммарная частота запросов превысит rate_limit
+    plan = [(search_keyword, filters)
+            for search_keyword in keywords
+            for filters in plan_slices(search_keyword, areas=areas, rate_limit=rate_limit, **hh_options)]
+    hh_options = dict(hh_options, rate_limit=rate_limit / processes)
+    seen = set()
+    pairs = set()
+    # Файл пишет только основной процесс, поэтому строки срезов не перемешиваются
+    sink = open(ndjson_path, 'a', encoding='UTF-8') if ndjson_path else None
+    executor = ProcessPoolExecutor(max_workers=processes)
+    # Ключевое слово каждого среза в работе, запись удаляется, когда срез обработан
+    futures = {}
+    try:
+        plan = iter(plan)
+        while True:
+            # В работе держим не больше processes * 2 срезов, как HeadHunter._map: готовые вакансии не копятся,
+            # если запись в базу данных медленнее загрузки, а при ошибке не приходится ждать весь план
+            for search_keyword, filters in plan:
+                futures[executor.submit(crawl_slice, search_keyword, filters, hh_options)] = search_keyword
+                if len(futures) >= processes * 2:
+                    break
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                search_keyword = futures.pop(future)
+                items, snapshot = future.result()
+                METRICS.merge(snapshot)
+                for item in items:
+                    # Одна вакансия может попасть в несколько срезов и ключевых слов
+                    new = item['id'] not in seen
+                    if new:
+                        seen.add(item['id'])
+                        if sink is not None:
+                            sink.write(json.dumps(item, ensure_ascii=False) + '\n')
+                    if not with_keywords:
+                        if new:
+                            yield item
+                    elif (search_keyword, item['id']) not in pairs:
+                        pairs.add((search_keyword, item['id']))
+                        yield search_keyword, item
+    finally:
+        # Если срез упал или потребитель остановился раньше, отменяем еще не начатые срезы, а не
+        # загружаем остаток плана; ждем только срезы, которые уже выполняются
+        executor.shutdown(cancel_futures=True)
+        if sink is not None:
+            sink.close()
+
+
+def ingest_sharded(db, keywords, batch_size=1000, processes=4, **options) -> dict:
+    """Загружает вакансии по списку ключевых слов срезами и записывает их в базу данных пакетами"""
+    tagged = iter_sharded_vacancies(keywords, processes=processes, with_keywords=True, **options)
+    return load_tagged_batches(db, iter_batches(tagged, batch_size), batch_size)
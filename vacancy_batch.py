@@ -0,0 +1,211 @@
+import json
+import os
+from array import array
+
+import numpy as np
+
+
+class StringDictionary:
+    """Словарь уникальных строк в одном буфере UTF-8.
+
+    Строка с номером code занимает байты data[offsets[code]:offsets[code + 1]], поэтому словарь
+    хранится двумя массивами NumPy без отдельного объекта str на каждую строку.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        return self.data[self.offsets[code]:self.offsets[code + 1]].tobytes().decode('UTF-8')
+
+    def decode(self, codes):
+        """Возвращает массив строк (dtype=object) с номерами codes"""
+        return np.array([self[code] for code in codes], dtype=object)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+
+class _Interner:
+    """Строит StringDictionary: каждая уникальная строка хранится один раз, а в столбце лежит ее номер"""
+
+    def __init__(self):
+        # Индекс строк нужен только на время построения и не попадает в хранилище
+        self.codes = {}
+        self.data = bytearray()
+        self.offsets = array('q', [0])
+
+    def code(self, value):
+        value = value or ''
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.offsets) - 1
+            self.data += value.encode('UTF-8')
+            self.offsets.append(len(self.data))
+        return code
+
+    def dictionary(self):
+        # Смещения помещаются в int32, пока буфер меньше 2 ГБ
+        dtype = np.int32 if len(self.data) < 2 ** 31 else np.int64
+        # Копируем буфер, чтобы не держать запас емкости bytearray
+        return StringDictionary(np.frombuffer(self.data, dtype=np.uint8).copy(),
+                                np.frombuffer(self.offsets, dtype=np.int64).astype(dtype))
+
+
+class VacancyBatch:
+    """Столбцовое хранилище вакансий в памяти для аналитики без базы данных.
+
+    Числовые поля хранятся в массивах NumPy, а названия вакансий, города и названия
+    работодателей - в словарях уникальных строк StringDictionary. Отсутствующая зарплата хранится как NaN.
+    """
+
+    # Столбцы с их типами; в снимке каждый столбец хранится отдельным .npy-файлом.
+    # Идентификаторы помещаются в int32, как и в таблицах базы данных, а float32 точно хранит
+    # целые зарплаты до 16 миллионов
+    COLUMNS = {'vacancy_id': np.int32,
+               'salary_min': np.float32,
+               'salary_max': np.float32,
+               'employer_id': np.int32,
+               'employer_code': np.int32,
+               'city_code': np.int32,
+               'name_code': np.int32}
+    # Словари строк в порядке аргументов конструктора
+    DICTIONARIES = ('names', 'cities', 'employers')
+
+    def __init__(self, columns, names, cities, employers):
+        # Массивы столбцов одинаковой длины
+        for column in self.COLUMNS:
+            setattr(self, column, columns[column])
+        # Словари уникальных названий вакансий, городов и названий работодателей (StringDictionary)
+        self.names = names
+        self.cities = cities
+        self.employers = employers
+
+    def __len__(self):
+        return len(self.vacancy_id)
+
+    @classmethod
+    def from_items(cls, items):
+        """Строит хранилище из вакансий в формате ответа API (элементы items)"""
+        # Пока строим хранилище, копим значения в компактных массивах array, а не в списках объектов
+        buffers = {'vacancy_id': array('i'), 'salary_min': array('f'), 'salary_max': array('f'),
+                   'employer_id': array('i'), 'employer_code': array('i'), 'city_code': array('i'),
+                   'name_code': array('i')}
+        names, cities, employers = _Interner(), _Interner(), _Interner()
+        for item in items:
+            salary = item.get('salary') or {}
+            employer = item.get('employer') or {}
+            buffers['vacancy_id'].append(int(item['id']))
+            buffers['salary_min'].append(np.nan if salary.get('from') is None else salary['from'])
+            buffers['salary_max'].append(np.nan if salary.get('to') is None else salary['to'])
+            buffers['employer_id'].append(int(employer.get('id') or 0))
+            buffers['employer_code'].append(employers.code(employer.get('name')))
+            buffers['city_code'].append(cities.code((item.get('area') or {}).get('name')))
+            buffers['name_code'].append(names.code(item.get('name')))
+        columns = {column: np.frombuffer(buffers[column], dtype=dtype) if len(buffers[column])
+                   else np.empty(0, dtype=dtype)
+                   for column, dtype in cls.COLUMNS.items()}
+        return cls(columns, names.dictionary(), cities.dictionary(), employers.dictionary())
+
+    @classmethod
+    def from_pages(cls, pages):
+        """Строит хранилище из страниц ответа API, например из HeadHunter.iter_pages()"""
+        return cls.from_items(item for page in pages for item in page.get('items', []))
+
+    @classmethod
+    def load_ndjson(cls, path):
+        """Строит хранилище из NDJSON-файла с вакансиями в формате API, который выводят crawl и --ndjson.
+
+        Кортежи HeadHunter.get_info не принимаются: в них нет верхней границы зарплаты, по которой
+        считаются отчеты, и названия работодателя.
+        """
+        def iter_items():
+            with open(path, encoding='UTF-8') as file:
+                for number, line in enumerate(file, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError(f'{path}:{number}: expected a vacancy in API format, '
+                                         f'got {type(record).__name__}')
+                    yield record
+
+        return cls.from_items(iter_items())
+
+    def save(self, directory):
+        """Сохраняет снимок: по .npy-файлу на столбец и на буфер и смещения каждого словаря строк"""
+        os.makedirs(directory, exist_ok=True)
+        for column in self.COLUMNS:
+            np.save(os.path.join(directory, f'{column}.npy'), getattr(self, column))
+        for dictionary in self.DICTIONARIES:
+            strings = getattr(self, dictionary)
+            np.save(os.path.join(directory, f'{dictionary}_data.npy'), strings.data)
+            np.save(os.path.join(directory, f'{dictionary}_offsets.npy'), strings.offsets)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Загружает снимок; при mmap=True столбцы и словари отображаются в память, а не читаются целиком"""
+        mmap_mode = 'r' if mmap else None
+
+        def load_array(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        columns = {column: load_array(column) for column in cls.COLUMNS}
+        dictionaries = [StringDictionary(load_array(f'{dictionary}_data'), load_array(f'{dictionary}_offsets'))
+                        for dictionary in cls.DICTIONARIES]
+        return cls(columns, *dictionaries)
+
+    def nbytes(self):
+        """Возвращает размер столбцов и словарей строк в байтах"""
+        return (sum(getattr(self, column).nbytes for column in self.COLUMNS)
+                + sum(getattr(self, dictionary).nbytes for dictionary in self.DICTIONARIES))
+
+    def _average_salary(self):
+        """Средняя максимальная зарплата по вакансиям, где она указана, или None"""
+        known = self.salary_max[~np.isnan(self.salary_max)]
+        # Суммируем в float64, чтобы не терять точность на миллионах строк
+        return float(known.mean(dtype=np.float64)) if len(known) else None
+
+    def get_avg_salary(self) -> list:
+        """Аналог DBManager.get_avg_salary: [(средняя максимальная зарплата,)]"""
+        average = self._average_salary()
+        # Округляем половины вверх, как ROUND в PostgreSQL, а не к четному, как round в Python
+        return [(int(np.floor(average + 0.5)) if average is not None else None,)]
+
+    def get_vacancies_with_higher_salary(self) -> list:
+        """Аналог DBManager.get_vacancies_with_higher_salary: [(vacancy_name, salary_max)]"""
+        average = self._average_salary()
+        if average is None:
+            return []
+        # NaN при сравнении дает False, поэтому вакансии без зарплаты отбрасываются автоматически
+        selected = np.flatnonzero(self.salary_max > average)
+        salaries = self.salary_max[selected]
+        # Декодируем только названия отобранных вакансий и сортируем по их рангам, а не по строкам
+        codes, inverse = np.unique(self.name_code[selected], return_inverse=True)
+        names = self.names.decode(codes)
+        name_rank = np.argsort(np.argsort(names))
+        # Сортируем по убыванию зарплаты, затем по названию вакансии
+        order = np.lexsort((name_rank[inverse], -salaries))
+        return [(names[inverse[index]], int(salaries[index])) for index in order]
+
+    def get_companies_and_vacancies_count(self) -> list:
+        """Аналог DBManager.get_companies_and_vacancies_count: [(employer_name, quantity_vacancies)].
+
+        Вакансии считаются по employer_id; если название работодателя неизвестно, вместо него
+        выводится идентификатор.
+        """
+        employer_ids, first, counts = np.unique(self.employer_id, return_index=True, return_counts=True)
+        names = self.employers.decode(self.employer_code[first])
+        unknown = names == ''
+        names[unknown] = employer_ids[unknown].astype(str)
+        # Ранги названий в алфавитном порядке, чтобы сортировать по номерам, а не по строкам
+        name_rank = np.argsort(np.argsort(names))
+        # Сортируем по убыванию количества вакансий, затем по названию компании
+        order = np.lexsort((name_rank, -counts))
+        return [(str(names[index]), int(counts[index])) for index in order]